@@ -6,6 +6,7 @@ import os
 from dotenv import load_dotenv
 import geocoder
 import time
+import math
 from openai import OpenAI
 
 client = OpenAI(
@@ -24,35 +25,39 @@ OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
 app = Flask(__name__)
 model = whisper.load_model("base")  # Menggunakan model "base" Whisper
 
-# Fungsi untuk mendeteksi bahasa audio dengan Whisper
-def detect_language(mel):
-    _, probs = model.detect_language(mel)
-    return max(probs, key=probs.get)
+# Batas decode: token dibatasi dari durasi audio dan batas kata, bukan dipotong setelah decode.
+# Durasi dihitung untuk ucapan cepat (4 kata/detik) plus cadangan, agar ucapan biasa tidak terpotong
+MAX_WORDS = 250
+TOKENS_PER_WORD = 3
+WORDS_PER_SECOND = 4
+BUDGET_HEADROOM = 1.25
+
+# Fungsi untuk mendeteksi bahasa audio dengan Whisper (dari hasil encoder, bukan mel)
+def detect_language(audio_features):
+    _, probs = model.detect_language(audio_features)
+    return max(probs[0], key=probs[0].get)
 
 
 # Fungsi untuk mentranskripsi audio
 def transcribe_audio(audio_path):
-    # Load audio dan memangkas jika lebih dari 10 detik
     audio = whisper.load_audio(audio_path)
-    audio = whisper.pad_or_trim(audio)
-    
-    # Membuat log-Mel spectrogram
-    mel = whisper.log_mel_spectrogram(audio, n_mels=model.dims.n_mels).to(model.device)
-    
-    # Deteksi bahasa
-    language = detect_language(mel)
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+
+    # Encode sekali; hasilnya dipakai untuk deteksi bahasa dan decode
+    audio_features = model.embed_audio(mel.unsqueeze(0))
+    language = detect_language(audio_features)
     print(f"Detected language: {language}")
-    
-    # Decode audio
-    options = whisper.DecodingOptions(language=language)
-    result = whisper.decode(model, mel, options)
-    
+
+    # Hanya 30 detik pertama yang didekode (seperti semula); rekaman panjang lewat be-python /api/transcribe/long
+    duration = min(len(audio), whisper.audio.N_SAMPLES) / whisper.audio.SAMPLE_RATE
+    sample_len = max(16, min(model.dims.n_text_ctx - 8,  # room for the start-of-transcript tokens
+                             math.ceil(duration * WORDS_PER_SECOND * TOKENS_PER_WORD * BUDGET_HEADROOM),
+                             MAX_WORDS * TOKENS_PER_WORD))
+    options = whisper.DecodingOptions(language=language, without_timestamps=True, fp16=False,
+                                      sample_len=sample_len)
+    text = whisper.decode(model, audio_features, options)[0].text.strip()
     # Batasi output teks menjadi 250 kata maksimal
-    words = result.text.split()
-    if len(words) > 250:
-        result.text = " ".join(words[:250])
-    
-    return result.text
+    return " ".join(text.split()[:MAX_WORDS])
 
 
 # Fungsi untuk mendapatkan informasi cuaca berdasarkan lokasi
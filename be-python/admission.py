@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge(
+    'admission_in_flight', 'Admitted jobs currently running', ('pool',)))
+ADMISSION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'admission_queue_depth', 'Jobs waiting for a slot', ('pool',)))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'admission_rejected_total', 'Jobs rejected by admission control', ('pool', 'reason')))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    'admission_queue_wait_seconds', 'Time spent waiting for a slot', ('pool', 'job_class'),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)))
+
+# Relative decode cost per second of audio (base = 1), used to turn a
+# clip's duration into an estimated service time for SJF ordering
+MODEL_COST = {
+    'tiny': 0.5, 'base': 1.0, 'small': 2.5, 'medium': 6.0, 'large': 12.0, 'turbo': 4.0,
+}
+
+# Upper bounds (seconds of audio) for the job_class label
+JOB_CLASSES = ((3.0, 'short'), (10.0, 'medium'), (float('inf'), 'long'))
+
+
+def job_class(duration):
+    for limit, name in JOB_CLASSES:
+        if duration <= limit:
+            return name
+
+
+def model_cost(model_name):
+    """Bobot biaya relatif model; 'large-v3', 'small.en' dst. ikut keluarganya"""
+    family = (model_name or 'base').split('.')[0].split('-')[0]
+    return MODEL_COST.get(family, 1.0)
+
+
+class Overloaded(Exception):
+    """Raised when a job can't be admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted', 'cancelled')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded, time-limited wait queue.
+
+    At most ``max_concurrent`` jobs run at once, at most ``max_queue``
+    wait, and none waits longer than ``max_wait`` seconds. Everything
+    else is rejected immediately with :class:`Overloaded`, so admitted
+    jobs keep a predictable latency under overload.
+
+    With ``scheduler='sjf'`` a freed slot goes to the queued job with the
+    smallest estimated cost (``duration * cost_factor``) instead of the
+    oldest one. Aging credits ``aging`` seconds of cost per second waited,
+    so a long clip is eventually served even under a stream of short ones.
+    """
+
+    def __init__(self, name, max_concurrent=1, max_queue=8, max_wait=20.0,
+                 scheduler='fifo', cost_factor=1.0, aging=1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.scheduler = scheduler
+        self.cost_factor = cost_factor
+        self.aging = aging
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._queue = []  # heap of (key, seq, waiter)
+        self._seq = itertools.count()
+        self._avg_service = 1.0  # EWMA of job duration, seconds
+        self.rejected = {'queue_full': 0, 'timeout': 0}
+
+    def _queue_key(self, seq, arrival, duration=0, **job):
+        if self.scheduler != 'sjf':
+            return seq
+        # Linear aging, priority = cost - aging * waited. The "- aging * now"
+        # part is the same for every queued job, so the key can be fixed at push time.
+        return duration * self.cost_factor + self.aging * arrival
+
+    def _update_gauges(self):
+        ADMISSION_IN_FLIGHT.set(self._active, pool=self.name)
+        ADMISSION_QUEUE_DEPTH.set(self._waiting, pool=self.name)
+
+    def retry_after(self):
+        """Perkiraan detik sampai antrean cukup longgar untuk mencoba lagi"""
+        backlog = (self._waiting + self._active) / max(1, self.max_concurrent)
+        return max(1, int(round(backlog * self._avg_service)))
+
+    def saturated(self):
+        """True kalau permintaan baru pasti ditolak (cek murah sebelum upload disimpan)"""
+        return self._waiting >= self.max_queue and self._active >= self.max_concurrent
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(pool=self.name, reason=reason)
+        raise Overloaded(reason, self.retry_after())
+
+    def acquire(self, **job):
+        start = time.monotonic()
+        labels = {'pool': self.name, 'job_class': job_class(job.get('duration', 0))}
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._update_gauges()
+                ADMISSION_WAIT.observe(0, **labels)
+                return
+            if self._waiting >= self.max_queue:
+                self._reject('queue_full')
+            waiter = _Waiter()
+            seq = next(self._seq)
+            heapq.heappush(self._queue, (self._queue_key(seq, start, **job), seq, waiter))
+            self._waiting += 1
+            self._update_gauges()
+
+        waiter.event.wait(self.max_wait)
+
+        with self._lock:
+            waited = time.monotonic() - start
+            if waiter.granted:
+                ADMISSION_WAIT.observe(waited, **labels)
+                return
+            # Timed out: leave the entry in the heap, release() skips cancelled waiters
+            waiter.cancelled = True
+            self._waiting -= 1
+            self._update_gauges()
+            self._reject('timeout')
+
+    def release(self, service_time=None):
+        with self._lock:
+            if service_time is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * service_time
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # Hand the slot straight to the next waiter
+                waiter.granted = True
+                self._waiting -= 1
+                self._update_gauges()
+                waiter.event.set()
+                return
+            self._active -= 1
+            self._update_gauges()
+
+    @contextmanager
+    def admit(self, **job):
+        self.acquire(**job)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pool": self.name,
+                "in_flight": self._active,
+                "queued": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "scheduler": self.scheduler,
+                "avg_service_seconds": round(self._avg_service, 3),
+                "rejected": dict(self.rejected),
+            }
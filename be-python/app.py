@@ -1,165 +1,252 @@
-from flask import Flask, json, request, jsonify, send_from_directory
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, Response, current_app, json, request, jsonify, stream_with_context
 import os
 import requests
 import uuid
 from datetime import datetime
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import subprocess
-from dotenv import load_dotenv
-import whisper
+import time
 import logging
-from flask_ngrok import run_with_ngrok
 from flask_cors import CORS
 from flask_migrate import Migrate
-
-# Load environment variables
-load_dotenv()
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from models import db, configure_engine, create_missing_indexes, SESSION_NAME_LENGTH, Session, SessionLanguage, SessionSummary, Message, Change, ArchivedSession, CHANGE_CONDITION, record_change, record_message_changes, change_seq_range, delete_session_rows, serialize_session, serialize_message, summarize_added, refresh_summary
+from audio_storage import AudioStore
+from archive import SessionArchive
+from inference import WhisperEngine
+from admission import Overloaded
+from singleflight import SingleFlight, COALESCED_REQUESTS
+import idempotency
+from media import send_media
+import metrics
+import profiling
+import uploads
+import responses
+from ratelimit import RateLimiter
+from metrics import stage, UPSTREAM_ERRORS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-run_with_ngrok(app)
-CORS(app)
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'chatbot.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-# API Keys
-OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-
-# File upload configuration
-UPLOAD_FOLDER = 'uploads/audio'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-MAX_AUDIO_DURATION = 30  # seconds
-MIN_AUDIO_DURATION = 0.5  # seconds
-
-# Database Models
-class Session(db.Model):
-    __tablename__ = 'sessions'
-    
-    id = db.Column(db.String(36), primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    created_at = db.Column(db.BigInteger, nullable=False)
-    updated_at = db.Column(db.BigInteger, nullable=False)
-    
-    messages = db.relationship('Message', backref='session', lazy=True, cascade='all, delete-orphan')
+# Change feed configuration
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_WAIT = 20  # seconds, well under the gunicorn worker timeout
+CHANGES_POLL_INTERVAL = 1.0  # seconds, re-check DB for writes from other workers
 
-class Message(db.Model):
-    __tablename__ = 'messages'
-    
-    id = db.Column(db.String(36), primary_key=True)
-    session_id = db.Column(db.String(36), db.ForeignKey('sessions.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    role = db.Column(db.String(20), nullable=False)
-    timestamp = db.Column(db.BigInteger, nullable=False)
-    image_path = db.Column(db.String(255))
-    audio_path = db.Column(db.String(255))
+# DeepSeek prompts and fallback replies
+CHAT_SYSTEM_PROMPT = ("Anda adalah asisten pertanian PeTaniku. Tolong format jawaban dengan:\n"
+                      "1. Ganti **teks** dengan *teks* untuk bold\n"
+                      "2. Hindari penggunaan markdown seperti ### untuk heading\n"
+                      "3. Gunakan garis baru untuk pemisah bagian")
+TRANSCRIBE_SYSTEM_PROMPT = "Anda adalah asisten pertanian PeTaniku."
+DEEPSEEK_UNAVAILABLE_REPLY = "Maaf, saya tidak bisa memberikan jawaban saat ini."
+DEEPSEEK_ERROR_REPLY = "Maaf, terjadi kesalahan dalam memproses permintaan Anda."
 
-migrate = Migrate(app, db)
+api = Blueprint('api', __name__)
+# Batch mode: SQLite can't ALTER most columns, so migrations copy the table there
+migrate = Migrate(render_as_batch=True)
+audio_store = AudioStore()
+session_archive = SessionArchive()
+whisper_engine = WhisperEngine()
+rate_limiter = RateLimiter()
+inflight = SingleFlight()
 
-# Whisper model initialization
-try:
-    WHISPER_MODEL = whisper.load_model("base")
-    logging.info("Whisper model loaded successfully")
-except Exception as e:
-    logging.error(f"Failed to load Whisper model: {e}")
-    WHISPER_MODEL = None
 
-with app.app_context():
-    db.drop_all()  # WARNING: Deletes all data!
-    db.create_all()
+def create_app(config_object=Config):
+    """Bangun aplikasi Flask; tidak ada kerja berat yang dilakukan saat import"""
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_object(config_object)
 
-if not os.access(UPLOAD_FOLDER, os.W_OK):
-    logger.error(f"Upload folder not writable: {UPLOAD_FOLDER}")
+    if app.config['USE_NGROK']:
+        from flask_ngrok import run_with_ngrok
+        run_with_ngrok(app)
+    CORS(app)
+    if app.config['TRUSTED_PROXY_COUNT']:
+        # request.remote_addr (and so the rate limit key) is the client, not the proxy
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
 
+    db.init_app(app)
+    migrate.init_app(app, db)
+    metrics.init_app(app)
+    responses.init_app(app)
+    profiling.init_app(app)
+    uploads.init_app(app)
+    rate_limiter.init_app(app)
 
+    upload_folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    if not os.access(upload_folder, os.W_OK):
+        logger.error(f"Upload folder not writable: {upload_folder}")
+    audio_store.init_app(app)
+    session_archive.init_app(app)
+    whisper_engine.init_app(app)
 
+    app.register_blueprint(api)
 
-@app.route('/api/transcribe', methods=['POST'])
-def transcribe_audio():
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+        if app.config['RESET_DB_ON_START']:
+            db.drop_all()  # WARNING: Deletes all data!
+        if app.config['DB_CREATE_ALL']:
+            db.create_all()
+            create_missing_indexes()  # SQLite files from before an index was added
+        engine = db.engine
+    # Workers forked from a preloading master (gunicorn.conf.py) must not reuse its pooled connections
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
 
-    audio_file = request.files['audio']
-    if audio_file.filename == '':
-        return jsonify({"error": "Empty filename"}), 400
+    elapsed = time.perf_counter() - started
+    metrics.STARTUP_SECONDS.set(elapsed)
+    logger.info(f"App created in {elapsed * 1000:.0f} ms")
+    return app
 
+
+@api.route('/api/transcribe', methods=['POST'])
+def transcribe_audio():
+    # Shed load before spending time on the upload
+    if whisper_engine.admission.saturated():
+        return overloaded_response(whisper_engine.admission.retry_after())
+
+    # Streamed to a temp file as it arrives; it only enters the audio store once it's valid
+    with stage('save'):
+        upload, error = uploads.take_audio()
+    if error:
+        return jsonify(error[0]), error[1]
+    filepath, sha256 = upload
     try:
-        # Save file
-        filename = f"audio_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{str(uuid.uuid4())[:8]}.wav"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        audio_file.save(filepath)
+        # A retried upload of the same clip joins the transcription already running
+        session_id = request.form.get('session_id')
+        return coalesced(
+            'api.transcribe_audio',
+            idempotency.fingerprint('transcribe', sha256, session_id=session_id),
+            lambda key: transcribe_exchange(filepath, sha256, session_id, key)
+        )
+
+    except Overloaded as e:
+        logger.warning(f"Transcription rejected: {e}")
+        return overloaded_response(e.retry_after)
+    except Exception as e:
+        logging.error(f"Transcription error: {str(e)}")
+        return jsonify({"error": "Audio processing failed"}), 500
+    finally:
+        if os.path.exists(filepath):
+            os.remove(filepath)
 
-        # Validate audio
+def transcribe_exchange(filepath, sha256, session_id, idempotency_key=None):
+    """Validasi, transkripsi, jawab dan simpan; kembalikan (body, status)"""
+    # Validate audio
+    with stage('probe'):
         validation = validate_audio_file(filepath)
+    if validation.get('error'):
+        return validation, 400
+    max_duration = current_app.config['UPLOAD_MAX_SECONDS']
+    if validation.get('duration', 0) > max_duration:
+        return {"error": f"Audio too long (max {max_duration:.0f} seconds)"}, 400
+
+    # Transcribe
+    with stage('whisper'):
+        result = run_transcription(filepath, validation.get('duration', 0), session_id)
+    transcription = result['text']
+    
+    if not transcription:
+        return {"error": "No speech detected"}, 400
+
+    with stage('store'):
+        audio_url = audio_store.public_url(audio_store.put(filepath, sha256))
+
+    # Get AI response
+    with stage('deepseek'):
+        ai_response = get_deepseek_response(transcription)
+
+    body = {
+        "status": "success",
+        "transcription": transcription,
+        "ai_response": ai_response,
+        "audio_url": audio_url,
+        "audio_expires_at": None,  # referenced by the saved message
+        "metadata": transcription_metadata(result)
+    }
+    saved = False
+    if session_id:
+        try:
+            with stage('db_commit'):
+                saved = save_exchange(session_id, transcription, ai_response, audio_url=audio_url,
+                                      idempotency_key=idempotency_key, response=(body, 200))
+        except Exception as e:
+            logger.error(f"Error saving transcribed messages: {e}")
+            db.session.rollback()
+    if not saved:
+        # Nothing references the audio yet; it stays until then, or until GC after the grace period
+        body["audio_expires_at"] = audio_store.expires_at(sha256)
+    return body, 200
+
+@api.route('/api/transcribe/long', methods=['POST'])
+def transcribe_long():
+    """Transkripsi rekaman panjang; ?stream=true mengirim segmen sebagai NDJSON"""
+    if whisper_engine.admission.saturated():
+        return overloaded_response(whisper_engine.admission.retry_after())
+
+    with stage('save'):
+        upload, error = uploads.take_audio()
+    if error:
+        return jsonify(error[0]), error[1]
+    filepath, _ = upload
+    streaming = False
+    try:
+        language = request.values.get('language') or None
+        if language:
+            language = whisper_engine.language_code(language)
+            if language is None:
+                return jsonify({"error": f"Unsupported language: {request.values['language']}"}), 400
+
+        with stage('probe'):
+            validation = validate_audio_file(filepath)
         if validation.get('error'):
             return jsonify(validation), 400
+        duration = validation.get('duration', 0)
+        max_duration = current_app.config['LONGFORM_MAX_DURATION']
+        if duration > max_duration:
+            return jsonify({"error": f"Audio too long (max {max_duration:.0f} seconds)"}), 400
 
-        # Transcribe
-        result = WHISPER_MODEL.transcribe(
+        segments = whisper_engine.transcribe_long(
             filepath,
-            language="id",
-            task="transcribe"
+            language=language,
+            batch_size=current_app.config['WHISPER_BATCH_SIZE']
         )
-        transcription = result.get("text", "").strip()
-        
-        if not transcription:
-            return jsonify({"error": "No speech detected"}), 400
 
-        # Get AI response
-        ai_response = get_deepseek_response(transcription)
-            
-        session_id = request.form.get('session_id')
-        if session_id:
-            try:
-                current_time = int(datetime.now().timestamp() * 1000)
-                
-                # Save user audio message
-                user_message = Message(
-                    id=str(uuid.uuid4()),
-                    session_id=session_id,
-                    content=transcription,
-                    role='user',
-                    timestamp=current_time,
-                    audio_path=f"/uploads/audio/{filename}"
-                )
-                
-                # Save assistant response
-                assistant_message = Message(
-                    id=str(uuid.uuid4()),
-                    session_id=session_id,
-                    content=ai_response,
-                    role='assistant',
-                    timestamp=current_time + 1
-                )
-                
-                # Update session
-                session = db.session.get(Session, session_id)
-                if session:
-                    session.updated_at = current_time
-                    db.session.add_all([user_message, assistant_message])
-                    db.session.commit()
-            except Exception as e:
-                logger.error(f"Error saving transcribed messages: {e}")
-                db.session.rollback()
+        if request.values.get('stream', 'false').lower() == 'true':
+            streaming = True  # the generator removes the temp file when it's done
+            return Response(stream_with_context(stream_segments(segments, filepath, duration)),
+                            mimetype='application/x-ndjson')
 
+        with stage('whisper'):
+            segments = list(segments)
         return jsonify({
             "status": "success",
-            "transcription": transcription,
-            "ai_response": ai_response,
-            "audio_url": f"/uploads/audio/{filename}"
+            "transcription": join_segments(segments),
+            "segments": segments,
+            "duration": duration
         })
 
+    except Overloaded as e:
+        logger.warning(f"Long-form transcription rejected: {e}")
+        return overloaded_response(e.retry_after)
     except Exception as e:
-        logging.error(f"Transcription error: {str(e)}")
+        logger.error(f"Long-form transcription error: {e}")
         return jsonify({"error": "Audio processing failed"}), 500
+    finally:
+        if not streaming and os.path.exists(filepath):
+            os.remove(filepath)
+
+@api.route('/api/transcribe/status', methods=['GET'])
+def transcribe_status():
+    """Kedalaman antrean dan jumlah penolakan transkripsi (per proses worker)"""
+    return jsonify(whisper_engine.admission.snapshot())
 
-# @app.route('/api/transcribe', methods=['POST'])
+# @api.route('/api/transcribe', methods=['POST'])
 # def transcribe_audio():
 #     if 'audio' not in request.files:
 #         return jsonify({"error": "No audio file provided"}), 400
@@ -200,7 +287,7 @@ def transcribe_audio():
 #         logging.error(f"Transcription error: {str(e)}")
 #         return jsonify({"error": "Audio processing failed"}), 500
 
-# @app.route('/api/sessions/<session_id>/messages', methods=['POST'])
+# @api.route('/api/sessions/<session_id>/messages', methods=['POST'])
 # def save_message(session_id):
 #     try:
 #         data = request.json
@@ -270,7 +357,7 @@ def validate_audio_file(filepath):
         # Validasi dengan ffprobe
         result = subprocess.run([
             'ffprobe', '-v', 'error',
-            '-show_entries', 'stream=codec_type,sample_rate,channels',
+            '-show_entries', 'stream=codec_type,sample_rate,channels:format=duration',
             '-of', 'json',
             filepath
         ], capture_output=True, text=True)
@@ -293,7 +380,8 @@ def validate_audio_file(filepath):
                 if int(stream.get('channels', 0)) < 1:
                     return {"error": "No audio channels"}
                     
-        return {"valid": True}
+        duration = float(probe_data.get('format', {}).get('duration') or 0)
+        return {"valid": True, "duration": duration}
         
         
     except json.JSONDecodeError:
@@ -301,30 +389,36 @@ def validate_audio_file(filepath):
     except Exception as e:
         return {"error": f"Validation error: {str(e)}"}
     
-@app.route('/')
+@api.route('/')
 def home():
     return jsonify({"status": "Flask is running!"})
 
 # Session management endpoints
-@app.route('/api/sessions', methods=['GET'])
+@api.route('/api/sessions', methods=['GET'])
 def get_sessions():
     try:
+        # One query: the summary is joined in (Session.summary is lazy='joined')
         sessions = Session.query.order_by(Session.updated_at.desc()).all()
-        return jsonify([{
-            "id": session.id,
-            "name": session.name,
-            "created_at": session.created_at,
-            "updated_at": session.updated_at
-        } for session in sessions])
+        missing = [session for session in sessions if session.summary is None]
+        if missing:
+            # Sessions created before summaries were kept; fill them in once
+            for session in missing:
+                refresh_summary(session)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # another worker filled them in first
+                sessions = Session.query.order_by(Session.updated_at.desc()).all()
+        return jsonify([serialize_session(session) for session in sessions])
     except Exception as e:
         logger.error(f"Error getting sessions: {e}")
         return jsonify({"error": "Failed to get sessions"}), 500
 
-@app.route('/api/sessions', methods=['POST'])
+@api.route('/api/sessions', methods=['POST'])
 def create_session():
     try:
         data = request.json
-        name = data.get('name', 'New Chat')
+        name = data.get('name', 'New Chat')[:SESSION_NAME_LENGTH]  # SQLite doesn't enforce the column length, PostgreSQL does
         
         session_id = str(uuid.uuid4())
         current_time = int(datetime.now().timestamp() * 1000)
@@ -333,24 +427,21 @@ def create_session():
             id=session_id,
             name=name,
             created_at=current_time,
-            updated_at=current_time
+            updated_at=current_time,
+            summary=SessionSummary(session_id=session_id, message_count=0, has_audio=False)
         )
         
         db.session.add(new_session)
+        record_change('session', session_id, 'insert', session_id)
         db.session.commit()
         
-        return jsonify({
-            "id": session_id,
-            "name": name,
-            "created_at": current_time,
-            "updated_at": current_time
-        })
+        return jsonify(serialize_session(new_session))
     except Exception as e:
         logger.error(f"Error creating session: {e}")
         db.session.rollback()
         return jsonify({"error": "Failed to create session"}), 500
 
-@app.route('/api/sessions/<session_id>', methods=['PUT'])
+@api.route('/api/sessions/<session_id>', methods=['PUT'])
 def update_session(session_id):
     try:
         data = request.json
@@ -364,8 +455,9 @@ def update_session(session_id):
             return jsonify({"error": "Session not found"}), 404
         
         current_time = int(datetime.now().timestamp() * 1000)
-        session.name = name
+        session.name = name[:SESSION_NAME_LENGTH]
         session.updated_at = current_time
+        record_change('session', session_id, 'update', session_id)
         
         db.session.commit()
         
@@ -375,14 +467,16 @@ def update_session(session_id):
         db.session.rollback()
         return jsonify({"error": "Failed to update session"}), 500
 
-@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+@api.route('/api/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     try:
         session = db.session.get(Session, session_id)
         if not session:
             return jsonify({"error": "Session not found"}), 404
         
-        db.session.delete(session)
+        # Set-based: the session's messages are never loaded; its audio goes to the GC
+        audio_store.release_session(session_id)
+        delete_session_rows(session_id)
         db.session.commit()
         
         return jsonify({"message": "Session deleted successfully"})
@@ -391,8 +485,42 @@ def delete_session(session_id):
         db.session.rollback()
         return jsonify({"error": "Failed to delete session"}), 500
 
+@api.route('/api/sessions/archived', methods=['GET'])
+def get_archived_sessions():
+    try:
+        archived = ArchivedSession.query.order_by(ArchivedSession.updated_at.desc()).all()
+        return jsonify([{
+            "id": a.session_id,
+            "name": a.name,
+            "created_at": a.created_at,
+            "updated_at": a.updated_at,
+            "message_count": a.message_count,
+            "archived_at": a.archived_at
+        } for a in archived])
+    except Exception as e:
+        logger.error(f"Error getting archived sessions: {e}")
+        return jsonify({"error": "Failed to get archived sessions"}), 500
+
+@api.route('/api/sessions/<session_id>/restore', methods=['POST'])
+def restore_session(session_id):
+    try:
+        session = session_archive.restore(session_id)
+        if session is None:
+            session = db.session.get(Session, session_id)
+            if session is None:
+                return jsonify({"error": "Archived session not found"}), 404
+        return jsonify(serialize_session(session))
+    except IntegrityError:
+        # Restored concurrently by another request
+        db.session.rollback()
+        return jsonify(serialize_session(db.session.get(Session, session_id)))
+    except Exception as e:
+        logger.error(f"Error restoring session: {e}")
+        db.session.rollback()
+        return jsonify({"error": "Failed to restore session"}), 500
+
 # Message management endpoints
-# @app.route('/api/sessions/<session_id>/messages', methods=['GET'])
+# @api.route('/api/sessions/<session_id>/messages', methods=['GET'])
 # def get_messages(session_id):
 #     try:
 #         messages = Message.query.filter_by(session_id=session_id).order_by(Message.timestamp.asc()).all()
@@ -408,27 +536,21 @@ def delete_session(session_id):
 #         logger.error(f"Error getting messages: {e}")
 #         return jsonify({"error": "Failed to get messages"}), 500
 
-@app.route('/api/sessions/<session_id>/messages', methods=['GET'])
+@api.route('/api/sessions/<session_id>/messages', methods=['GET'])
 def get_messages(session_id):
     try:
-        messages = Message.query.filter_by(session_id=session_id)\
-                              .order_by(Message.timestamp.asc())\
-                              .all()
-        
-        return jsonify([{
-            "id": msg.id,
-            "session_id": msg.session_id,
-            "content": msg.content,
-            "role": msg.role,
-            "timestamp": msg.timestamp,
-            "image_path": msg.image_path,
-            "audio_path": msg.audio_path  # This will now work after migration
-        } for msg in messages])
+        query = Message.query.filter_by(session_id=session_id)\
+                             .order_by(Message.timestamp.asc())
+        # Long histories are written row by row instead of as one big list
+        summary = db.session.get(SessionSummary, session_id)
+        if summary and summary.message_count > current_app.config['STREAM_ARRAY_THRESHOLD']:
+            return responses.stream_json_array(query.yield_per(responses.STREAM_BATCH), serialize_message)
+        return jsonify([serialize_message(msg) for msg in query])
     except Exception as e:
         logger.error(f"Error getting messages: {e}")
         return jsonify({"error": "Failed to get messages"}), 500
     
-@app.route('/api/sessions/<session_id>/messages', methods=['POST'])
+@api.route('/api/sessions/<session_id>/messages', methods=['POST'])
 def save_message(session_id):
     try:
         data = request.json
@@ -460,6 +582,10 @@ def save_message(session_id):
         session.updated_at = int(datetime.now().timestamp() * 1000)
 
         db.session.add(message)
+        summarize_added(session, [message])
+        audio_store.add_ref(message.audio_path)
+        record_change('message', message.id, 'insert', session_id)
+        record_change('session', session_id, 'update', session_id)
         db.session.commit()
 
         return jsonify({
@@ -477,7 +603,7 @@ def save_message(session_id):
         logger.error(f"Error saving message: {str(e)}")
         return jsonify({"error": "Failed to save message", "details": str(e)}), 500
     
-@app.route('/api/sessions/<session_id>/messages/<message_id>', methods=['DELETE'])
+@api.route('/api/sessions/<session_id>/messages/<message_id>', methods=['DELETE'])
 def delete_message(session_id, message_id):
     try:
         message = Message.query.filter_by(id=message_id, session_id=session_id).first()
@@ -485,6 +611,10 @@ def delete_message(session_id, message_id):
             return jsonify({"error": "Message not found"}), 404
         
         db.session.delete(message)
+        audio_store.release(message.audio_path)
+        refresh_summary(db.session.get(Session, session_id))
+        record_change('message', message_id, 'delete', session_id)
+        record_change('session', session_id, 'update', session_id)
         db.session.commit()
         
         return jsonify({"message": "Message deleted successfully"})
@@ -493,10 +623,16 @@ def delete_message(session_id, message_id):
         db.session.rollback()
         return jsonify({"error": "Failed to delete message"}), 500
 
-@app.route('/api/sessions/<session_id>/messages', methods=['DELETE'])
+@api.route('/api/sessions/<session_id>/messages', methods=['DELETE'])
 def clear_messages(session_id):
     try:
-        Message.query.filter_by(session_id=session_id).delete()
+        audio_store.release_session(session_id)
+        record_message_changes(session_id, 'delete')
+        Message.query.filter_by(session_id=session_id).delete(synchronize_session=False)
+        session = db.session.get(Session, session_id)
+        if session:
+            refresh_summary(session)
+            record_change('session', session_id, 'update', session_id)
         db.session.commit()
         
         return jsonify({"message": "All messages cleared successfully"})
@@ -505,7 +641,75 @@ def clear_messages(session_id):
         db.session.rollback()
         return jsonify({"error": "Failed to clear messages"}), 500
 
-@app.route('/api/weather', methods=['GET'])
+def fetch_changes(since, limit):
+    return Change.query.filter(Change.seq > since)\
+                       .order_by(Change.seq.asc())\
+                       .limit(limit)\
+                       .all()
+
+def serialize_changes(changes):
+    """Gabungkan change dengan data terbaru dari baris yang masih ada"""
+    session_ids = {c.entity_id for c in changes if c.entity == 'session' and c.op != 'delete'}
+    message_ids = {c.entity_id for c in changes if c.entity == 'message' and c.op != 'delete'}
+    sessions = {s.id: s for s in Session.query.filter(Session.id.in_(session_ids))} if session_ids else {}
+    messages = {m.id: m for m in Message.query.filter(Message.id.in_(message_ids))} if message_ids else {}
+
+    items = []
+    for change in changes:
+        data = None
+        if change.entity == 'session' and change.entity_id in sessions:
+            data = serialize_session(sessions[change.entity_id])
+        elif change.entity == 'message' and change.entity_id in messages:
+            data = serialize_message(messages[change.entity_id])
+        items.append({
+            "seq": change.seq,
+            "entity": change.entity,
+            "op": change.op,
+            "id": change.entity_id,
+            "session_id": change.session_id,
+            "timestamp": change.timestamp,
+            "data": data  # None if the row has been deleted since
+        })
+    return items
+
+@api.route('/api/changes', methods=['GET'])
+def get_changes():
+    try:
+        since = request.args.get('since', 0, type=int)
+        limit = max(1, min(request.args.get('limit', CHANGES_PAGE_SIZE, type=int), CHANGES_PAGE_SIZE))
+        wait = max(0.0, min(request.args.get('wait', 0, type=float), CHANGES_MAX_WAIT))
+        deadline = time.monotonic() + wait
+
+        oldest, newest = change_seq_range()
+        if oldest is not None and since < oldest - 1:
+            # Changes after `since` were pruned (CHANGES_RETENTION_DAYS)
+            return jsonify({
+                "error": "Changes since this seq are no longer kept, reload sessions and messages",
+                "resync": True,
+                "last_seq": newest
+            }), 410
+
+        changes = fetch_changes(since, limit)
+        while not changes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Release the DB connection while waiting so it isn't held for the whole poll
+            db.session.close()
+            with CHANGE_CONDITION:
+                CHANGE_CONDITION.wait(timeout=min(CHANGES_POLL_INTERVAL, remaining))
+            changes = fetch_changes(since, limit)
+
+        return jsonify({
+            "changes": serialize_changes(changes),
+            "last_seq": changes[-1].seq if changes else since,
+            "has_more": len(changes) == limit
+        })
+    except Exception as e:
+        logger.error(f"Error getting changes: {e}")
+        return jsonify({"error": "Failed to get changes"}), 500
+
+@api.route('/api/weather', methods=['GET'])
 def get_weather():
     try:
         lat = request.args.get('lat', type=float)
@@ -516,40 +720,19 @@ def get_weather():
             return jsonify(get_mock_weather_data())
             
         # Get weather data from OpenWeather
-        weather_data = get_openweather_data(lat, lon)
+        with stage('openweather'):
+            weather_data = get_openweather_data(lat, lon)
         
         if not weather_data:
-            return jsonify({
-                'error': 'Failed to fetch weather data',
-                'mock': True,
-                'temperature': 30.0,
-                'condition': 'sunny',
-                'description': 'Cerah',
-                'location': 'Jakarta',
-                'advice': 'Cocok untuk panen atau pengeringan hasil panen'
-            }), 500
+            return jsonify(weather_fallback('Failed to fetch weather data')), 500
         
-        return jsonify({
-            'temperature': weather_data['main']['temp'],
-            'condition': map_weather_condition(weather_data['weather'][0]['main']),
-            'description': weather_data['weather'][0]['description'],
-            'location': weather_data.get('name', 'Unknown Location'),
-            'advice': get_farming_advice(weather_data['weather'][0]['main'])
-        })
+        return jsonify(build_weather_response(weather_data))
         
     except Exception as e:
         logger.error(f"Weather API error: {e}")
-        return jsonify({
-            'error': str(e),
-            'mock': True,
-            'temperature': 30.0,
-            'condition': 'sunny',
-            'description': 'Cerah',
-            'location': 'Jakarta',
-            'advice': 'Cocok untuk panen atau pengeringan hasil panen'
-        }), 500
-
-@app.route('/api/chat', methods=['POST'])
+        return jsonify(weather_fallback(str(e))), 500
+
+@api.route('/api/chat', methods=['POST'])
 def chat():
     try:
         data = request.json
@@ -558,103 +741,120 @@ def chat():
         
         if not message:
             return jsonify({"error": "Message is required"}), 400
-        
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "Anda adalah asisten pertanian PeTaniku. Tolong format jawaban dengan:\n"
-                                            "1. Ganti **teks** dengan *teks* untuk bold\n"
-                                            "2. Hindari penggunaan markdown seperti ### untuk heading\n"
-                                            "3. Gunakan garis baru untuk pemisah bagian"},
-                {"role": "user", "content": message}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-        
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=payload
+
+        # Identical concurrent requests (client retries) share one DeepSeek call
+        return coalesced(
+            'api.chat',
+            idempotency.fingerprint('chat', idempotency.normalize_text(message), session_id=session_id),
+            lambda key: chat_exchange(message, session_id, key)
         )
-        
-        result = response.json()
-        
-        if response.status_code == 200:
-            assistant_message = result['choices'][0]['message']['content']
-            
-            # Remove markdown headings and ensure proper bold formatting
-            formatted_message = assistant_message.replace('###', '').replace('**', '*')
-            
-            # Create a clean version for TTS (without formatting markers)
-            clean_tts_message = formatted_message.replace('*', '')
-            
-            if session_id:
-                try:
-                    session = db.session.get(Session, session_id)
-                    if not session:
-                        return jsonify({"error": "Session not found"}), 404
-                    
-                    current_time = int(datetime.now().timestamp() * 1000)
-                    
-                    # Save user message
-                    user_message = Message(
-                        id=str(uuid.uuid4()),
-                        session_id=session_id,
-                        content=message,
-                        role='user',
-                        timestamp=current_time
-                    )
-                    
-                    # Save assistant message
-                    assistant_message = Message(
-                        id=str(uuid.uuid4()),
-                        session_id=session_id,
-                        content=formatted_message,
-                        role='assistant',
-                        timestamp=current_time + 1  # Ensure ordering
-                    )
-                    
-                    # Update session timestamp
-                    session.updated_at = current_time
-                    
-                    db.session.add_all([user_message, assistant_message])
-                    db.session.commit()
-                except Exception as e:
-                    logger.error(f"Error saving messages to database: {e}")
-                    db.session.rollback()
-            
-            return jsonify({
-                "response": formatted_message,
-                "clean_tts_message": clean_tts_message,
-                "is_farming_related": True
-            })
-        else:
-            logger.error(f"DeepSeek API error: {result}")
-            return jsonify({"error": "Failed to get response from AI", "details": result}), response.status_code
             
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Chat API error: {e}")
+        UPSTREAM_ERRORS.inc(upstream='deepseek', reason='exception')
+        return jsonify({"error": "An error occurred while processing your message"}), 500
     except Exception as e:
         logger.error(f"Chat API error: {e}")
         return jsonify({"error": "An error occurred while processing your message"}), 500
 
-@app.route('/uploads/audio/<filename>')
-def serve_audio(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+def chat_exchange(message, session_id, idempotency_key=None):
+    """Minta jawaban DeepSeek dan simpan; kembalikan (body, status)"""
+    url, headers, payload = deepseek_request(message, CHAT_SYSTEM_PROMPT)
+    with stage('deepseek'):
+        response = requests.post(url, headers=headers, json=payload)
+    
+    result = response.json()
+    
+    if response.status_code != 200:
+        logger.error(f"DeepSeek API error: {result}")
+        UPSTREAM_ERRORS.inc(upstream='deepseek', reason=f"http_{response.status_code}")
+        return {"error": "Failed to get response from AI", "details": result}, response.status_code
 
-def load_whisper_model():
-    try:
-        model = whisper.load_model("base")
-        return model
-    except Exception as e:
-        logger.error(f"Failed to load Whisper model: {str(e)}")
-        return None
+    formatted_message, clean_tts_message = format_chat_reply(result['choices'][0]['message']['content'])
+    body = {
+        "response": formatted_message,
+        "clean_tts_message": clean_tts_message,
+        "is_farming_related": True
+    }
+
+    if session_id:
+        try:
+            with stage('db_commit'):
+                saved = save_exchange(session_id, message, formatted_message,
+                                      idempotency_key=idempotency_key, response=(body, 200))
+            if not saved:
+                return {"error": "Session not found"}, 404
+        except Exception as e:
+            logger.error(f"Error saving messages to database: {e}")
+            db.session.rollback()
+    
+    return body, 200
+
+def coalesced(endpoint, fingerprint, work):
+    """Jalankan work(idempotency_key) -> (body, status) sekali untuk request duplikat.
+
+    Concurrent requests with the same fingerprint (or the same
+    Idempotency-Key) in this process wait for the first one and get its
+    response. With an Idempotency-Key the response is also stored, so a
+    later retry is answered from the database without redoing the work.
+    """
+    key = request.headers.get(idempotency.HEADER)
 
-app.whisper_model = load_whisper_model()
+    def run():
+        if key:
+            early = idempotency.begin(key, endpoint, fingerprint)
+            if early:
+                return early
+        try:
+            body, status = work(key)
+        except BaseException:
+            if key:
+                idempotency.release(key)
+            raise
+        if key:
+            idempotency.finish(key, status, body)
+        return body, status, {}
+
+    (body, status, headers), shared = inflight.do(f"{endpoint}:{key or fingerprint}", run)
+    COALESCED_REQUESTS.inc(endpoint=endpoint, role='follower' if shared else 'leader')
+    return jsonify(body), status, headers
+
+def send_stored_audio(filename):
+    path, mimetype, blob = audio_store.resolve(filename)
+    if not path:
+        return jsonify({"error": "Audio not found"}), 404
+
+    # Content-addressed blobs already carry their hash; legacy files are hashed on demand
+    etag = f"{blob.sha256}-{blob.codec}" if blob else None
+    # A WAV blob is swapped for Opus under the same URL, so it is only cached with revalidation
+    max_age = current_app.config['AUDIO_CACHE_MAX_AGE']
+    if blob and not audio_store.is_final(blob):
+        max_age = None
+    offload_uri = None
+    if current_app.config['AUDIO_SENDFILE_MODE'] == 'x-accel-redirect':
+        relative = os.path.relpath(path, audio_store.root).replace(os.sep, '/')
+        offload_uri = f"{current_app.config['AUDIO_ACCEL_PREFIX'].rstrip('/')}/{relative}"
+
+    return send_media(
+        path,
+        mimetype=mimetype,
+        etag=etag,
+        max_age=max_age,
+        offload=current_app.config['AUDIO_SENDFILE_MODE'] or None,
+        offload_uri=offload_uri
+    )
+
+@api.route('/uploads/audio/<filename>', methods=['GET', 'HEAD'])
+def serve_audio(filename):
+    try:
+        return send_stored_audio(filename)
+    except FileNotFoundError:
+        # The blob was re-encoded between lookup and open, resolve again
+        db.session.expire_all()
+        try:
+            return send_stored_audio(filename)
+        except FileNotFoundError:
+            return jsonify({"error": "Audio not found"}), 404
 
 def map_weather_condition(weather_main):
     """Map OpenWeather conditions to our frontend conditions"""
@@ -672,14 +872,32 @@ def map_weather_condition(weather_main):
 def get_openweather_data(lat, lon):
     """Fetch weather data from OpenWeather API"""
     try:
-        url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric&lang=id"
-        response = requests.get(url)
+        response = requests.get(openweather_url(lat, lon))
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         logger.error(f"OpenWeather API error: {e}")
+        UPSTREAM_ERRORS.inc(upstream='openweather', reason='exception')
         return None
 
+def openweather_url(lat, lon):
+    config = current_app.config
+    return f"{config['OPENWEATHER_API_URL']}/data/2.5/weather?lat={lat}&lon={lon}&appid={config['OPENWEATHER_API_KEY']}&units=metric&lang=id"
+
+def build_weather_response(weather_data):
+    """Ubah respons OpenWeather ke format frontend"""
+    return {
+        'temperature': weather_data['main']['temp'],
+        'condition': map_weather_condition(weather_data['weather'][0]['main']),
+        'description': weather_data['weather'][0]['description'],
+        'location': weather_data.get('name', 'Unknown Location'),
+        'advice': get_farming_advice(weather_data['weather'][0]['main'])
+    }
+
+def weather_fallback(error):
+    """Mock weather data returned alongside an error"""
+    return {'error': error, 'mock': True, **get_mock_weather_data()}
+
 def get_farming_advice(weather_main):
     """Get farming advice based on weather condition"""
     weather_main = weather_main.lower()
@@ -708,37 +926,169 @@ def get_mock_weather_data():
 def get_deepseek_response(prompt):
     """Get response from DeepSeek API"""
     try:
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "Anda adalah asisten pertanian PeTaniku."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-        
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
+        url, headers, payload = deepseek_request(prompt, TRANSCRIBE_SYSTEM_PROMPT)
+        response = requests.post(url, headers=headers, json=payload)
         
         if response.status_code == 200:
             result = response.json()
             return result['choices'][0]['message']['content']
         else:
             logger.error(f"DeepSeek API error: {response.text}")
-            return "Maaf, saya tidak bisa memberikan jawaban saat ini."
+            UPSTREAM_ERRORS.inc(upstream='deepseek', reason=f"http_{response.status_code}")
+            return DEEPSEEK_UNAVAILABLE_REPLY
             
     except Exception as e:
         logger.error(f"Error getting DeepSeek response: {e}")
-        return "Maaf, terjadi kesalahan dalam memproses permintaan Anda."
+        UPSTREAM_ERRORS.inc(upstream='deepseek', reason='exception')
+        return DEEPSEEK_ERROR_REPLY
+
+def deepseek_request(prompt, system_prompt):
+    """URL, header dan payload untuk DeepSeek chat completions"""
+    config = current_app.config
+    headers = {
+        "Authorization": f"Bearer {config['DEEPSEEK_API_KEY']}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1000
+    }
+    return f"{config['DEEPSEEK_API_URL']}/v1/chat/completions", headers, payload
+
+def format_chat_reply(content):
+    """Return (formatted message, clean TTS message) for a DeepSeek reply"""
+    # Remove markdown headings and ensure proper bold formatting
+    formatted_message = content.replace('###', '').replace('**', '*')
+    # Create a clean version for TTS (without formatting markers)
+    clean_tts_message = formatted_message.replace('*', '')
+    return formatted_message, clean_tts_message
+
+def save_exchange(session_id, user_content, assistant_content, audio_url=None, idempotency_key=None, response=None):
+    """Simpan pesan user + asisten dalam satu transaksi; False jika sesi tidak ada.
+
+    With ``idempotency_key`` the (body, status) ``response`` is stored
+    in the same transaction, so a retry can't save the messages twice.
+    """
+    session = db.session.get(Session, session_id)
+    if not session:
+        return False
+
+    current_time = int(datetime.now().timestamp() * 1000)
+    
+    # Save user message
+    user_message = Message(
+        id=str(uuid.uuid4()),
+        session_id=session_id,
+        content=user_content,
+        role='user',
+        timestamp=current_time,
+        audio_path=audio_url
+    )
+    
+    # Save assistant message
+    assistant_message = Message(
+        id=str(uuid.uuid4()),
+        session_id=session_id,
+        content=assistant_content,
+        role='assistant',
+        timestamp=current_time + 1  # Ensure ordering
+    )
+    
+    # Update session timestamp
+    session.updated_at = current_time
+    
+    db.session.add_all([user_message, assistant_message])
+    summarize_added(session, [user_message, assistant_message])
+    audio_store.add_ref(audio_url)
+    record_change('message', user_message.id, 'insert', session_id)
+    record_change('message', assistant_message.id, 'insert', session_id)
+    record_change('session', session_id, 'update', session_id)
+    if idempotency_key:
+        body, status = response
+        idempotency.store_response(idempotency_key, status, body)
+    db.session.commit()
+    return True
+
+def overloaded_response(retry_after):
+    """503 dengan Retry-After saat antrean transkripsi penuh"""
+    return jsonify({
+        "error": "Server is busy, please try again later",
+        "retry_after": retry_after
+    }), 503, {'Retry-After': str(retry_after)}
+
+def join_segments(segments):
+    return " ".join(segment['text'] for segment in segments)
+
+def stream_segments(segments, filepath, duration):
+    """Kirim tiap segmen begitu batch-nya selesai, lalu baris 'done' dengan teks lengkap"""
+    done = []
+    try:
+        with stage('whisper', 'api.transcribe_long'):
+            for segment in segments:
+                done.append(segment)
+                yield json.dumps({"type": "segment", **segment}) + "\n"
+        yield json.dumps({"type": "done", "transcription": join_segments(done), "duration": duration}) + "\n"
+    except Overloaded as e:
+        logger.warning(f"Long-form transcription rejected: {e}")
+        yield json.dumps({"type": "error", "error": "Server is busy, please try again later",
+                          "retry_after": e.retry_after}) + "\n"
+    except Exception as e:
+        logger.error(f"Long-form transcription error: {e}")
+        yield json.dumps({"type": "error", "error": "Audio processing failed"}) + "\n"
+    finally:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+def run_transcription(filepath, duration, session_id=None):
+    """Jalankan Whisper; hasilnya dict dari WhisperEngine.transcribe dengan teks yang sudah di-strip.
+
+    A session's remembered language skips language detection; a new,
+    confident detection is remembered for the session's next clips.
+    """
+    remembered = None
+    if session_id:
+        remembered = db.session.query(SessionLanguage.language).filter_by(session_id=session_id).scalar()
+        db.session.rollback()  # don't hold a read transaction open during decoding
+
+    result = whisper_engine.transcribe(filepath, duration=duration, language=remembered, task="transcribe")
+
+    if session_id and result['language_probability'] is not None:
+        remember_language(session_id, result['language'], result['language_probability'])
+    result['text'] = result['text'].strip()
+    return result
+
+def transcription_metadata(result):
+    return {
+        "language": result['language'],
+        "decode_steps": result['decode_steps'],
+        "stopped_early": result['stopped_early'],
+        "budget_exhausted": result['budget_exhausted']
+    }
+
+def remember_language(session_id, language, probability):
+    """Simpan bahasa sesi jika deteksinya cukup yakin, lupakan jika tidak"""
+    try:
+        memory = db.session.get(SessionLanguage, session_id)
+        if probability >= current_app.config['WHISPER_LANGUAGE_CONFIDENCE']:
+            if not db.session.get(Session, session_id):
+                return
+            if memory is None:
+                memory = SessionLanguage(session_id=session_id)
+                db.session.add(memory)
+            memory.language = language
+            memory.probability = probability
+            memory.updated_at = int(datetime.now().timestamp() * 1000)
+        elif memory is not None:
+            db.session.delete(memory)
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error saving session language: {e}")
+        db.session.rollback()
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    create_app().run()
\ No newline at end of file
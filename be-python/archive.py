@@ -0,0 +1,199 @@
+"""Cold storage for idle sessions.
+
+Sessions with no activity for ARCHIVE_AFTER_DAYS are moved out of the
+database into per-month compressed JSONL files in ARCHIVE_FOLDER
+(``sessions-YYYY-MM.jsonl.gz``, or ``.jsonl.zst`` with
+ARCHIVE_COMPRESSION=zstd), keyed by the month of the session's last
+activity. Every session is written as its own gzip member / zstd frame,
+so the files stay valid JSONL streams for the usual tools, and the byte
+range kept in ``archived_sessions`` lets a restore read just that one
+record. Audio of archived sessions stays referenced until restored.
+
+    flask archive-sessions [--older-than-days N] [--limit N]
+    flask restore-session <session_id>
+"""
+import fcntl
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import click
+
+from audio_storage import AudioStore, now_ms
+from models import (db, ArchivedSession, AudioBlob, Message, Session, SessionLanguage, delete_session_rows,
+                    record_change, record_message_changes, refresh_summary, serialize_message)
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, filename):
+    if filename.endswith(EXTENSIONS['zstd']):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class SessionArchive:
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.folder = app.config['ARCHIVE_FOLDER']
+        self.after_days = app.config['ARCHIVE_AFTER_DAYS']
+        self.codec = app.config['ARCHIVE_COMPRESSION']
+        if self.codec not in EXTENSIONS:
+            raise ValueError(f"ARCHIVE_COMPRESSION must be one of {', '.join(EXTENSIONS)}")
+        app.extensions['session_archive'] = self
+
+        @app.cli.command('archive-sessions')
+        @click.option('--older-than-days', type=float, help="default: ARCHIVE_AFTER_DAYS")
+        @click.option('--limit', type=int, help="at most this many sessions")
+        def archive_sessions_command(older_than_days, limit):
+            """Move idle sessions into the compressed monthly archive."""
+            print(self.archive_idle(older_than_days, limit))
+
+        @app.cli.command('restore-session')
+        @click.argument('session_id')
+        def restore_session_command(session_id):
+            """Bring an archived session back into the database."""
+            print("restored" if self.restore(session_id) else "not archived")
+
+    def archive_idle(self, older_than_days=None, limit=None):
+        """Arsipkan sesi yang tidak aktif lebih lama dari batas; satu transaksi per sesi"""
+        days = self.after_days if older_than_days is None else older_than_days
+        stats = {"sessions": 0, "messages": 0, "bytes": 0}
+        if days <= 0:
+            return stats
+        cutoff = now_ms() - int(days * 86400 * 1000)
+        query = db.session.query(Session.id).filter(Session.updated_at < cutoff).order_by(Session.updated_at.asc())
+        if limit:
+            query = query.limit(limit)
+        session_ids = [session_id for (session_id,) in query]
+        db.session.rollback()
+
+        for session_id in session_ids:
+            try:
+                archived = self.archive_session(session_id, cutoff)
+            except Exception as e:
+                logger.error(f"Archiving session {session_id} failed: {e}")
+                db.session.rollback()
+                continue
+            if archived:
+                stats["sessions"] += 1
+                stats["messages"] += archived.message_count
+                stats["bytes"] += archived.byte_length
+        logger.info(f"Session archival finished: {stats}")
+        return stats
+
+    def archive_session(self, session_id, cutoff=None):
+        """Tulis satu sesi ke file arsip bulanannya lalu hapus dari database"""
+        session = db.session.get(Session, session_id)
+        # Skip sessions that got a new message since they were picked
+        if session is None or (cutoff is not None and session.updated_at >= cutoff):
+            db.session.rollback()
+            return None
+
+        messages = [serialize_message(m) for m in
+                    Message.query.filter_by(session_id=session_id).order_by(Message.timestamp.asc())]
+        language = session.language
+        record = {
+            "session": {"id": session.id, "name": session.name,
+                        "created_at": session.created_at, "updated_at": session.updated_at},
+            "language": {"language": language.language, "probability": language.probability,
+                         "updated_at": language.updated_at} if language else None,
+            "messages": messages,
+        }
+        data = _compress((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'), self.codec)
+
+        filename = f"sessions-{datetime.fromtimestamp(session.updated_at / 1000):%Y-%m}{EXTENSIONS[self.codec]}"
+        offset = self._append(filename, data)
+
+        # The record is on disk before the rows go; a crash in between leaves
+        # an unreferenced record in the file and the session still in the database
+        audio_paths = [m['audio_path'] for m in messages if m['audio_path']]
+        db.session.add(ArchivedSession(
+            session_id=session.id,
+            name=session.name,
+            created_at=session.created_at,
+            updated_at=session.updated_at,
+            message_count=len(messages),
+            filename=filename,
+            byte_offset=offset,
+            byte_length=len(data),
+            audio_paths=json.dumps(audio_paths) if audio_paths else None,
+            archived_at=now_ms()
+        ))
+        delete_session_rows(session_id)
+        db.session.commit()
+        return db.session.get(ArchivedSession, session_id)
+
+    def _append(self, filename, data):
+        """Tambahkan data ke file arsip; kunci file menjaga offset antar worker"""
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock, open(os.path.join(self.folder, filename), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return offset
+
+    def read(self, archived):
+        """Baca rekaman satu sesi dari file arsipnya"""
+        with open(os.path.join(self.folder, archived.filename), 'rb') as f:
+            f.seek(archived.byte_offset)
+            data = f.read(archived.byte_length)
+        return json.loads(_decompress(data, archived.filename))
+
+    def restore(self, session_id):
+        """Kembalikan sesi arsip ke database. Returns the Session, or None if it isn't archived"""
+        archived = db.session.get(ArchivedSession, session_id)
+        if archived is None:
+            return None
+        record = self.read(archived)
+
+        info = record["session"]
+        # Restoring counts as activity, or the next archival run would take it straight back
+        session = Session(id=info["id"], name=info["name"], created_at=info["created_at"], updated_at=now_ms())
+        db.session.add(session)
+        if record.get("language"):
+            db.session.add(SessionLanguage(session_id=session.id, **record["language"]))
+
+        # Audio past AUDIO_RETENTION_DAYS may have been reclaimed while archived
+        shas = {AudioStore.sha_from_path(m['audio_path']) for m in record["messages"]} - {None}
+        existing = {sha for (sha,) in db.session.query(AudioBlob.sha256).filter(AudioBlob.sha256.in_(shas))} \
+            if shas else set()
+        messages = []
+        for message in record["messages"]:
+            sha = AudioStore.sha_from_path(message['audio_path'])
+            if sha and sha not in existing:
+                message = {**message, "audio_path": None}
+            messages.append(message)
+        db.session.flush()
+        db.session.bulk_insert_mappings(Message, messages)
+
+        refresh_summary(session)
+        record_change('session', session.id, 'insert', session.id)
+        record_message_changes(session.id, 'insert')
+        db.session.delete(archived)
+        db.session.commit()
+        logger.info(f"Restored session {session_id} ({len(messages)} messages) from {archived.filename}")
+        return session
+
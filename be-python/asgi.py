@@ -0,0 +1,417 @@
+"""Async serving mode.
+
+``/api/chat``, ``/api/weather`` and ``/api/transcribe`` spend most of
+their time waiting on DeepSeek/OpenWeather, so here they run as
+coroutines with a shared httpx.AsyncClient. One worker can then hold
+hundreds of upstream waits at once. Whisper runs on a dedicated thread
+pool and the SQLAlchemy work runs on the default one, so neither blocks
+the event loop. Every other route is served by the regular Flask app
+mounted underneath.
+
+    uvicorn --factory asgi:create_asgi_app --host 0.0.0.0 --port 5000
+    gunicorn -k uvicorn.workers.UvicornWorker "asgi:create_asgi_app()"
+"""
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    CHAT_SYSTEM_PROMPT, DEEPSEEK_ERROR_REPLY, DEEPSEEK_UNAVAILABLE_REPLY, TRANSCRIBE_SYSTEM_PROMPT,
+    audio_store, build_weather_response, create_app, deepseek_request, format_chat_reply,
+    get_mock_weather_data, openweather_url, run_transcription, save_exchange, transcription_metadata,
+    rate_limiter, validate_audio_file, weather_fallback, whisper_engine,
+)
+from admission import Overloaded
+from audio_storage import hash_file
+from singleflight import AsyncSingleFlight, COALESCED_REQUESTS
+import idempotency
+import uploads
+from config import Config
+from metrics import REQUEST_LATENCY, UPSTREAM_ERRORS, stage
+from models import db
+from ratelimit import SESSION_HEADER, bucket_for
+
+logger = logging.getLogger(__name__)
+
+
+def create_asgi_app(config_object=Config):
+    flask_app = create_app(config_object)
+    config = flask_app.config
+    # One thread per admission slot (running or queued): concurrency and queueing are
+    # bounded by whisper_engine.admission, not by a hidden executor backlog
+    whisper_executor = ThreadPoolExecutor(
+        max_workers=config['WHISPER_MAX_CONCURRENCY'] + config['WHISPER_MAX_QUEUE'],
+        thread_name_prefix='whisper')
+    state = {}
+    inflight = AsyncSingleFlight()
+
+    def in_app_context(func):
+        """Run a sync helper inside a Flask app context on a worker thread"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with flask_app.app_context():
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    db.session.rollback()
+                    raise
+                finally:
+                    db.session.remove()
+        return wrapper
+
+    def instrumented(endpoint):
+        """Record request latency under the same endpoint names as the Flask routes"""
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(request):
+                start = time.perf_counter()
+                response = await handler(request)
+                REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint,
+                                        method=request.method, status=response.status_code)
+                return response
+            return wrapper
+        return decorator
+
+    def rate_limited(endpoint):
+        """Same buckets, keys and headers as the Flask routes (ratelimit.py)"""
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(request):
+                bucket = bucket_for(endpoint, request.url.path)
+                if not rate_limiter.enabled or bucket is None:
+                    return await handler(request)
+                session_id = await _session_id(request) if rate_limiter.key_by == 'session' else None
+                if session_id:
+                    session_id = await run_in_threadpool(in_app_context(rate_limiter.known_session), session_id)
+                key = rate_limiter.key(request.client.host if request.client else '', session_id)
+                if rate_limiter.store.blocking:
+                    decision = await run_in_threadpool(rate_limiter.check, bucket, key)
+                else:
+                    decision = rate_limiter.check(bucket, key)
+                if decision is None:
+                    return await handler(request)
+                if not decision.allowed:
+                    return too_many_requests(decision)
+                response = await handler(request)
+                response.headers.update(decision.headers())
+                return response
+            return wrapper
+        return decorator
+
+    def with_config(func, *args):
+        with flask_app.app_context():
+            return func(*args)
+
+    async def deepseek_reply(prompt):
+        """Async twin of app.get_deepseek_response"""
+        url, headers, payload = with_config(deepseek_request, prompt, TRANSCRIBE_SYSTEM_PROMPT)
+        try:
+            response = await state['http'].post(url, headers=headers, json=payload)
+            if response.status_code == 200:
+                return response.json()['choices'][0]['message']['content']
+            logger.error(f"DeepSeek API error: {response.text}")
+            UPSTREAM_ERRORS.inc(upstream='deepseek', reason=f"http_{response.status_code}")
+            return DEEPSEEK_UNAVAILABLE_REPLY
+        except Exception as e:
+            logger.error(f"Error getting DeepSeek response: {e}")
+            UPSTREAM_ERRORS.inc(upstream='deepseek', reason='exception')
+            return DEEPSEEK_ERROR_REPLY
+
+    async def coalesced(request, endpoint, fingerprint, work):
+        """Async twin of app.coalesced; ``work`` is a coroutine function"""
+        key = request.headers.get(idempotency.HEADER)
+
+        async def run():
+            if key:
+                early = await run_in_threadpool(in_app_context(idempotency.begin), key, endpoint, fingerprint)
+                if early:
+                    return early
+            try:
+                body, status = await work(key)
+            except BaseException:
+                if key:
+                    await run_in_threadpool(in_app_context(idempotency.release), key)
+                raise
+            if key:
+                await run_in_threadpool(in_app_context(idempotency.finish), key, status, body)
+            return body, status, {}
+
+        (body, status, headers), shared = await inflight.do(f"{endpoint}:{key or fingerprint}", run)
+        COALESCED_REQUESTS.inc(endpoint=endpoint, role='follower' if shared else 'leader')
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    @instrumented('api.chat')
+    @rate_limited('api.chat')
+    async def chat(request):
+        endpoint = 'api.chat'
+        try:
+            data = await request.json()
+            message = data.get('message', '')
+            session_id = data.get('session_id', '')
+
+            if not message:
+                return JSONResponse({"error": "Message is required"}, status_code=400)
+
+            async def work(key):
+                url, headers, payload = with_config(deepseek_request, message, CHAT_SYSTEM_PROMPT)
+                with stage('deepseek', endpoint):
+                    response = await state['http'].post(url, headers=headers, json=payload)
+                result = response.json()
+
+                if response.status_code != 200:
+                    logger.error(f"DeepSeek API error: {result}")
+                    UPSTREAM_ERRORS.inc(upstream='deepseek', reason=f"http_{response.status_code}")
+                    return {"error": "Failed to get response from AI", "details": result}, response.status_code
+
+                formatted_message, clean_tts_message = format_chat_reply(result['choices'][0]['message']['content'])
+                body = {
+                    "response": formatted_message,
+                    "clean_tts_message": clean_tts_message,
+                    "is_farming_related": True
+                }
+
+                if session_id:
+                    try:
+                        with stage('db_commit', endpoint):
+                            saved = await run_in_threadpool(in_app_context(save_exchange), session_id,
+                                                            message, formatted_message, None, key, (body, 200))
+                        if not saved:
+                            return {"error": "Session not found"}, 404
+                    except Exception as e:
+                        logger.error(f"Error saving messages to database: {e}")
+
+                return body, 200
+
+            return await coalesced(
+                request, endpoint,
+                idempotency.fingerprint('chat', idempotency.normalize_text(message), session_id=session_id), work)
+        except httpx.HTTPError as e:
+            logger.error(f"Chat API error: {e}")
+            UPSTREAM_ERRORS.inc(upstream='deepseek', reason='exception')
+            return JSONResponse({"error": "An error occurred while processing your message"}, status_code=500)
+        except Exception as e:
+            logger.error(f"Chat API error: {e}")
+            return JSONResponse({"error": "An error occurred while processing your message"}, status_code=500)
+
+    @instrumented('api.get_weather')
+    @rate_limited('api.get_weather')
+    async def get_weather(request):
+        try:
+            params = request.query_params
+            lat = _float_param(params, 'lat')
+            lon = _float_param(params, 'lon')
+            if params.get('mock', 'false').lower() == 'true':
+                return JSONResponse(get_mock_weather_data())
+
+            try:
+                with stage('openweather', 'api.get_weather'):
+                    response = await state['http'].get(with_config(openweather_url, lat, lon))
+                response.raise_for_status()
+                weather_data = response.json()
+            except httpx.HTTPError as e:
+                logger.error(f"OpenWeather API error: {e}")
+                UPSTREAM_ERRORS.inc(upstream='openweather', reason='exception')
+                return JSONResponse(weather_fallback('Failed to fetch weather data'), status_code=500)
+
+            return JSONResponse(build_weather_response(weather_data))
+        except Exception as e:
+            logger.error(f"Weather API error: {e}")
+            return JSONResponse(weather_fallback(str(e)), status_code=500)
+
+    @instrumented('api.transcribe_audio')
+    @rate_limited('api.transcribe_audio')
+    async def transcribe_audio(request):
+        endpoint = 'api.transcribe_audio'
+        if whisper_engine.admission.saturated():
+            return overloaded_response(whisper_engine.admission.retry_after())
+        # python-multipart spools to disk but has no size limit of its own
+        too_large = JSONResponse(
+            {"error": f"Audio file too large (max {config['UPLOAD_MAX_BYTES'] / (1024 * 1024):.0f} MB)"},
+            status_code=413)
+        if int(request.headers.get('content-length') or 0) > config['MAX_CONTENT_LENGTH']:
+            return too_large
+
+        try:
+            form = await _limit_body(request, config['MAX_CONTENT_LENGTH']).form()
+        except BodyTooLarge:
+            return too_large
+        upload_id = form.get('upload_id')
+        audio_file = form.get('audio')
+        if upload_id:
+            # A finished resumable upload (uploads.py) instead of a file part
+            upload, error = await run_in_threadpool(in_app_context(uploads.resumable_finish), upload_id)
+            if error:
+                await form.close()
+                return JSONResponse(error[0], status_code=error[1])
+            filepath, sha256 = upload
+        elif not isinstance(audio_file, UploadFile) or audio_file.filename == '':
+            await form.close()
+            message = "Empty filename" if isinstance(audio_file, UploadFile) else "No audio file provided"
+            return JSONResponse({"error": message}, status_code=400)
+        else:
+            # Save to a temp file first; it only enters the audio store once it's valid
+            filepath = audio_store.temp_path()
+        try:
+            if not upload_id:
+                with stage('save', endpoint):
+                    await run_in_threadpool(_copy_upload, audio_file.file, filepath)
+                    sha256 = await run_in_threadpool(hash_file, filepath)
+
+            session_id = form.get('session_id')
+
+            async def work(key):
+                with stage('probe', endpoint):
+                    validation = await run_in_threadpool(validate_audio_file, filepath)
+                if validation.get('error'):
+                    return validation, 400
+                if validation.get('duration', 0) > config['UPLOAD_MAX_SECONDS']:
+                    return {"error": f"Audio too long (max {config['UPLOAD_MAX_SECONDS']:.0f} seconds)"}, 400
+
+                # CPU-bound decode goes to its own pool so it can't starve DB/IO threads
+                loop = asyncio.get_running_loop()
+                with stage('whisper', endpoint):
+                    result = await loop.run_in_executor(
+                        whisper_executor, in_app_context(run_transcription), filepath,
+                        validation.get('duration', 0), session_id)
+                transcription = result['text']
+                if not transcription:
+                    return {"error": "No speech detected"}, 400
+
+                with stage('store', endpoint):
+                    await run_in_threadpool(in_app_context(audio_store.put), filepath, sha256)
+                audio_url = audio_store.public_url(sha256)
+
+                with stage('deepseek', endpoint):
+                    ai_response = await deepseek_reply(transcription)
+
+                body = {
+                    "status": "success",
+                    "transcription": transcription,
+                    "ai_response": ai_response,
+                    "audio_url": audio_url,
+                    "audio_expires_at": None,  # referenced by the saved message
+                    "metadata": transcription_metadata(result)
+                }
+                saved = False
+                if session_id:
+                    try:
+                        with stage('db_commit', endpoint):
+                            saved = await run_in_threadpool(in_app_context(save_exchange), session_id,
+                                                            transcription, ai_response, audio_url, key, (body, 200))
+                    except Exception as e:
+                        logger.error(f"Error saving transcribed messages: {e}")
+                if not saved:
+                    # Nothing references the audio yet; it stays until then, or until GC after the grace period
+                    body["audio_expires_at"] = await run_in_threadpool(in_app_context(audio_store.expires_at), sha256)
+                return body, 200
+
+            # A retried upload of the same clip joins the transcription already running
+            return await coalesced(request, endpoint,
+                                   idempotency.fingerprint('transcribe', sha256, session_id=session_id), work)
+        except Overloaded as e:
+            logger.warning(f"Transcription rejected: {e}")
+            return overloaded_response(e.retry_after)
+        except Exception as e:
+            logger.error(f"Transcription error: {str(e)}")
+            return JSONResponse({"error": "Audio processing failed"}, status_code=500)
+        finally:
+            await form.close()
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        limits = httpx.Limits(max_connections=config['ASYNC_HTTP_MAX_CONNECTIONS'],
+                              max_keepalive_connections=config['ASYNC_HTTP_MAX_CONNECTIONS'])
+        async with httpx.AsyncClient(limits=limits, timeout=config['UPSTREAM_TIMEOUT']) as client:
+            state['http'] = client
+            yield
+        whisper_executor.shutdown(wait=False)
+
+    return Starlette(
+        routes=[
+            Route('/api/chat', chat, methods=['POST']),
+            Route('/api/weather', get_weather, methods=['GET']),
+            Route('/api/transcribe', transcribe_audio, methods=['POST']),
+            Mount('/', app=WSGIMiddleware(flask_app)),
+        ],
+        middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+        lifespan=lifespan,
+    )
+
+
+def overloaded_response(retry_after):
+    """Async twin of app.overloaded_response"""
+    return JSONResponse({"error": "Server is busy, please try again later", "retry_after": retry_after},
+                        status_code=503, headers={'Retry-After': str(retry_after)})
+
+
+def too_many_requests(decision):
+    """Async twin of ratelimit.too_many_requests"""
+    return JSONResponse({"error": "Too many requests, please slow down", "retry_after": decision.retry_after},
+                        status_code=429, headers=decision.headers())
+
+
+async def _session_id(request):
+    """Session id for RATELIMIT_KEY=session; like the Flask side, a multipart body is never read for it"""
+    session_id = request.headers.get(SESSION_HEADER) or request.query_params.get('session_id')
+    if not session_id and request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        session_id = data.get('session_id') if isinstance(data, dict) else None
+    return session_id
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _limit_body(request, max_bytes):
+    """The same request, raising BodyTooLarge once more than ``max_bytes`` of body arrived.
+
+    Content-Length alone doesn't bound a chunked upload, so the bytes are
+    counted as they are received, like uploads.UploadSink does for WSGI.
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > max_bytes:
+                raise BodyTooLarge()
+        return message
+    return Request(request.scope, receive)
+
+
+def _copy_upload(src, filepath):
+    src.seek(0)
+    with open(filepath, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _float_param(params, name):
+    """Same leniency as Flask's request.args.get(name, type=float)"""
+    try:
+        return float(params[name])
+    except (KeyError, ValueError):
+        return None
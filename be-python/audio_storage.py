@@ -0,0 +1,373 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ArchivedSession, AudioBlob, Message, record_change
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_PREFIX = '/uploads/audio/'
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{64}$')
+
+MIMETYPES = {
+    'wav': 'audio/wav',
+    'opus': 'audio/ogg',
+}
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Hitung sha256 isi file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioStore:
+    """Content-addressed audio storage with reference counting.
+
+    Uploads are stored once per content hash under ``<root>/objects``,
+    re-encoded to Opus in the background and reclaimed by :meth:`collect`
+    once no ``Message.audio_path`` points at them any more.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-transcode')
+
+    def init_app(self, app):
+        self.app = app
+        self.root = app.config['UPLOAD_FOLDER']
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        self.partial_dir = os.path.join(self.root, 'partial')  # resumable uploads, expired by uploads.py
+        self.transcode = app.config['AUDIO_TRANSCODE']
+        self.opus_bitrate = app.config['AUDIO_OPUS_BITRATE']
+        self.retention_days = app.config['AUDIO_RETENTION_DAYS']
+        self.gc_grace_seconds = app.config['AUDIO_GC_GRACE_SECONDS']
+        self.gc_interval = app.config['AUDIO_GC_INTERVAL']
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        app.extensions['audio_store'] = self
+
+        @app.cli.command('audio-gc')
+        def audio_gc_command():
+            """Reclaim unreferenced and expired audio files."""
+            print(self.collect())
+
+        if self.gc_interval > 0:
+            threading.Thread(target=self._gc_loop, name='audio-gc', daemon=True).start()
+
+    # Paths
+
+    def temp_path(self, suffix='.wav'):
+        return os.path.join(self.tmp_dir, f"{os.urandom(8).hex()}{suffix}")
+
+    def blob_path(self, blob):
+        return os.path.join(self.root, blob.filename)
+
+    def is_final(self, blob):
+        """True once the blob's bytes won't change: re-encoded, or stored with re-encoding off"""
+        return blob.codec == 'opus' or not self.transcode
+
+    @staticmethod
+    def public_url(sha256):
+        return f"{PUBLIC_PREFIX}{sha256}"
+
+    @staticmethod
+    def sha_from_path(audio_path):
+        """Ambil hash dari audio_path, None untuk file lama (non content-addressed)"""
+        if not audio_path or not audio_path.startswith(PUBLIC_PREFIX):
+            return None
+        name = audio_path[len(PUBLIC_PREFIX):]
+        return name if BLOB_NAME_RE.match(name) else None
+
+    def resolve(self, name):
+        """Return (absolute path, mimetype, blob) for a public file name"""
+        if BLOB_NAME_RE.match(name):
+            blob = db.session.get(AudioBlob, name)
+            if not blob:
+                return None, None, None
+            return self.blob_path(blob), MIMETYPES.get(blob.codec), blob
+        # Legacy uploads stored flat in the root folder
+        path = os.path.join(self.root, os.path.basename(name))
+        if not os.path.isfile(path):
+            return None, None, None
+        return path, None, None
+
+    # Storing
+
+    def put(self, src_path, sha256=None):
+        """Pindahkan file upload ke storage dan kembalikan hash-nya.
+
+        The blob row is committed right away so that a crash before the
+        referencing message is saved still leaves a row for GC to reclaim.
+        """
+        sha256 = sha256 or hash_file(src_path)
+        ref_count = db.session.query(AudioBlob.ref_count).filter_by(sha256=sha256).scalar()
+        if ref_count:
+            os.remove(src_path)
+            return sha256
+        if ref_count == 0:
+            # Restart the grace period so GC doesn't reclaim it before our message commits.
+            # Nothing updated means GC deleted the row meanwhile: store the file again below
+            refreshed = AudioBlob.query.filter_by(sha256=sha256, ref_count=0) \
+                .update({AudioBlob.last_released_at: now_ms()}, synchronize_session=False)
+            db.session.commit()
+            if refreshed:
+                os.remove(src_path)
+                return sha256
+
+        filename = os.path.join('objects', sha256[:2], f"{sha256}.wav")
+        dest = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        size = os.path.getsize(src_path)
+        shutil.move(src_path, dest)
+
+        try:
+            db.session.add(AudioBlob(
+                sha256=sha256,
+                filename=filename,
+                codec='wav',
+                size=size,
+                original_size=size,
+                ref_count=0,
+                created_at=now_ms()
+            ))
+            db.session.commit()
+        except IntegrityError:
+            # Same content uploaded concurrently; the other request owns the row
+            db.session.rollback()
+            return sha256
+
+        self.schedule_transcode(sha256)
+        return sha256
+
+    def expires_at(self, sha256):
+        """Kapan GC boleh menghapus blob tanpa referensi (epoch ms); None bila sudah direferensikan"""
+        blob = db.session.get(AudioBlob, sha256)
+        if blob is None or blob.ref_count > 0:
+            return None
+        return (blob.last_released_at or blob.created_at) + self.gc_grace_seconds * 1000
+
+    def add_ref(self, audio_path):
+        """Tambah referensi dalam transaksi yang sedang berjalan"""
+        sha256 = self.sha_from_path(audio_path)
+        if sha256:
+            AudioBlob.query.filter_by(sha256=sha256)\
+                           .update({AudioBlob.ref_count: AudioBlob.ref_count + 1}, synchronize_session=False)
+
+    def release(self, audio_path, count=1):
+        """Kurangi referensi dalam transaksi yang sedang berjalan"""
+        sha256 = self.sha_from_path(audio_path)
+        if sha256:
+            AudioBlob.query.filter(AudioBlob.sha256 == sha256, AudioBlob.ref_count > 0)\
+                           .update({AudioBlob.ref_count: case((AudioBlob.ref_count > count, AudioBlob.ref_count - count),
+                                                              else_=0),
+                                    AudioBlob.last_released_at: now_ms()}, synchronize_session=False)
+
+    def release_session(self, session_id):
+        """Lepas semua referensi audio pesan satu sesi: satu UPDATE per file, bukan per pesan.
+
+        Blobs that drop to zero references are reclaimed by :meth:`collect`
+        once AUDIO_GC_GRACE_SECONDS have passed; legacy flat files as orphans.
+        """
+        rows = db.session.query(Message.audio_path, func.count(Message.id))\
+                         .filter(Message.session_id == session_id, Message.audio_path.isnot(None))\
+                         .group_by(Message.audio_path)
+        for audio_path, count in rows.all():
+            self.release(audio_path, count)
+
+    # Background re-encoding
+
+    def schedule_transcode(self, sha256):
+        if self.transcode and self.app is not None:
+            self._executor.submit(self._transcode_job, sha256)
+
+    def _transcode_job(self, sha256):
+        with self.app.app_context():
+            try:
+                self.transcode_blob(sha256)
+            except Exception as e:
+                logger.error(f"Audio transcode failed for {sha256}: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def transcode_blob(self, sha256):
+        """Encode ulang blob WAV ke Opus (Ogg) dengan ffmpeg"""
+        blob = db.session.get(AudioBlob, sha256)
+        if not blob or blob.codec == 'opus':
+            return False
+
+        src = self.blob_path(blob)
+        filename = os.path.join('objects', sha256[:2], f"{sha256}.opus")
+        dest = os.path.join(self.root, filename)
+        tmp_dest = f"{dest}.part"
+
+        result = subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-i', src,
+            '-c:a', 'libopus', '-b:a', self.opus_bitrate,
+            '-application', 'voip',
+            '-f', 'ogg', tmp_dest
+        ], capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.error(f"ffmpeg opus encode failed for {sha256}: {result.stderr}")
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
+            return False
+
+        size = os.path.getsize(tmp_dest)
+        if size >= blob.size:
+            # Opus is not worth it for this clip, keep the original
+            os.remove(tmp_dest)
+            return False
+
+        os.replace(tmp_dest, dest)
+        blob.filename = filename
+        blob.codec = 'opus'
+        blob.size = size
+        db.session.commit()
+        # Readers that already opened the WAV keep their file handle
+        os.remove(src)
+        logger.info(f"Re-encoded audio {sha256}: {blob.original_size} -> {size} bytes")
+        return True
+
+    # Garbage collection
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(self.gc_interval)
+            with self.app.app_context():
+                try:
+                    self.collect()
+                except Exception as e:
+                    logger.error(f"Audio GC failed: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _delete_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def collect(self):
+        """Hapus file audio yang tidak direferensikan atau sudah kedaluwarsa"""
+        stats = {"reconciled": 0, "unreferenced": 0, "expired": 0, "orphan_files": 0, "bytes_freed": 0}
+        current = now_ms()
+        grace_cutoff = current - self.gc_grace_seconds * 1000
+
+        # 1. Reconcile reference counts against Message.audio_path
+        counts = {}
+        rows = db.session.query(Message.audio_path, func.count(Message.id))\
+                         .filter(Message.audio_path.like(f"{PUBLIC_PREFIX}%"))\
+                         .group_by(Message.audio_path)
+        for audio_path, count in rows:
+            sha256 = self.sha_from_path(audio_path)
+            if sha256:
+                counts[sha256] = count
+        # Archived sessions keep their audio until restored
+        for (paths,) in db.session.query(ArchivedSession.audio_paths).filter(ArchivedSession.audio_paths.isnot(None)):
+            for audio_path in json.loads(paths):
+                sha256 = self.sha_from_path(audio_path)
+                if sha256:
+                    counts[sha256] = counts.get(sha256, 0) + 1
+        for blob in AudioBlob.query.all():
+            expected = counts.get(blob.sha256, 0)
+            if blob.ref_count != expected:
+                blob.ref_count = expected
+                if expected == 0:
+                    blob.last_released_at = current
+                stats["reconciled"] += 1
+        db.session.commit()
+
+        # 2. Expire referenced audio past the retention period
+        if self.retention_days > 0:
+            retention_cutoff = current - self.retention_days * 86400 * 1000
+            for blob in AudioBlob.query.filter(AudioBlob.created_at < retention_cutoff, AudioBlob.ref_count > 0):
+                audio_path = self.public_url(blob.sha256)
+                for message in Message.query.filter_by(audio_path=audio_path):
+                    message.audio_path = None
+                    record_change('message', message.id, 'update', message.session_id)
+                blob.ref_count = 0
+                blob.last_released_at = grace_cutoff
+                stats["expired"] += 1
+            db.session.commit()
+
+        # 3. Drop unreferenced blobs once the grace period has passed
+        expired = (AudioBlob.ref_count == 0,
+                   func.coalesce(AudioBlob.last_released_at, AudioBlob.created_at) <= grace_cutoff)
+        unreferenced = AudioBlob.query.filter(*expired).with_entities(AudioBlob.sha256, AudioBlob.filename).all()
+        for sha256, filename in unreferenced:
+            # Re-checked in the DELETE: a put() of the same content may have restarted the grace period
+            if not AudioBlob.query.filter(AudioBlob.sha256 == sha256, *expired).delete(synchronize_session=False):
+                db.session.rollback()
+                continue
+            # Move the file aside before the row is gone: after the commit a put() of the
+            # same content stores a fresh file at this path, which must not be removed
+            path = os.path.join(self.root, filename)
+            doomed = f"{path}.gc"
+            try:
+                os.replace(path, doomed)
+            except FileNotFoundError:
+                doomed = None
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                if doomed:
+                    os.replace(doomed, path)
+                raise
+            size = os.path.getsize(doomed) if doomed else 0
+            if doomed:
+                self._delete_file(doomed)
+            stats["unreferenced"] += 1
+            stats["bytes_freed"] += size
+
+        # 4. Files on disk that nothing knows about (temp leftovers, unreferenced legacy uploads)
+        known = {os.path.normpath(os.path.join(self.root, b.filename))
+                 for b in AudioBlob.query.with_entities(AudioBlob.filename)}
+        legacy_refs = {os.path.basename(p) for (p,) in db.session.query(Message.audio_path)
+                       .filter(Message.audio_path.isnot(None))}
+        for (paths,) in db.session.query(ArchivedSession.audio_paths).filter(ArchivedSession.audio_paths.isnot(None)):
+            legacy_refs.update(os.path.basename(p) for p in json.loads(paths))
+        grace_cutoff_s = grace_cutoff / 1000
+        for dirpath, _, filenames in os.walk(self.root):
+            if os.path.normpath(dirpath) == os.path.normpath(self.partial_dir):
+                continue
+            is_flat = os.path.normpath(dirpath) == os.path.normpath(self.root)
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                if path in known or (is_flat and name in legacy_refs):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > grace_cutoff_s:
+                    continue
+                self._delete_file(path)
+                stats["orphan_files"] += 1
+                stats["bytes_freed"] += stat.st_size
+
+        logger.info(f"Audio GC finished: {stats}")
+        return stats
@@ -0,0 +1,80 @@
+"""Concurrent-request capacity of one worker: sync vs async serving.
+
+Runs /api/chat (and optionally /api/weather) against a single sync
+gunicorn worker and a single uvicorn worker (asgi.py), with the DeepSeek
+stand-in answering after a fixed delay, at increasing client
+concurrency. With a sync worker throughput stays at about
+1 / upstream latency no matter how many clients wait. With the async
+worker it should grow with concurrency until the stub or the CPU
+saturates.
+
+    python bench/async_capacity.py --levels 1,8,32,128 --deepseek-latency 1.0
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs  # noqa: E402
+from run import BACKEND_DIR, Server, drive, free_port, git_commit, summarize, scenario_chat, scenario_weather  # noqa: E402
+
+import requests  # noqa: E402
+
+MODES = {
+    'sync': "gunicorn -w 1 -b 127.0.0.1:{port} --timeout 300 app:create_app()",
+    'async': "uvicorn --factory asgi:create_asgi_app --host 127.0.0.1 --port {port} --workers 1 --no-access-log",
+}
+SCENARIOS = {'chat': scenario_chat, 'weather': scenario_weather}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--scenario', default='chat', choices=sorted(SCENARIOS))
+    parser.add_argument('--levels', default='1,8,32,128', help="client concurrency levels")
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--deepseek-latency', type=float, default=1.0)
+    parser.add_argument('--openweather-latency', type=float, default=1.0)
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'bench', 'results'))
+    args = parser.parse_args()
+
+    deepseek = stubs.start_deepseek(latency=args.deepseek_latency)
+    openweather = stubs.start_openweather(latency=args.openweather_latency)
+    levels = [int(level) for level in args.levels.split(',')]
+    results = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec='seconds'),
+                 "args": vars(args)},
+        "modes": {},
+    }
+
+    for mode in args.modes.split(','):
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, DEEPSEEK_API_URL=deepseek.url, OPENWEATHER_API_URL=openweather.url,
+                   DEEPSEEK_API_KEY='bench', OPENWEATHER_API_KEY='bench', RATELIMIT_ENABLED='false',
+                   BENCH_BASE_URL=base_url)
+        with Server(MODES[mode].format(port=port), env, startup_timeout=120):
+            session_id = requests.post(f"{base_url}/api/sessions", json={"name": "capacity"}, timeout=30).json()['id']
+            call = SCENARIOS[args.scenario](base_url, {'session_ids': [session_id]})
+            results["modes"][mode] = {}
+            for level in levels:
+                summary = summarize(*drive(call, level, args.duration))
+                results["modes"][mode][str(level)] = summary
+                print(f"{mode:6s} concurrency={level:4d} rps={summary['throughput_rps']:8.2f} "
+                      f"p50={summary['latency_ms']['p50']} p99={summary['latency_ms']['p99']} ms "
+                      f"errors={sum(summary['errors'].values())}")
+
+    deepseek.shutdown()
+    openweather.shutdown()
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}-async-capacity.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compare two benchmark result files written by run.py.
+
+    python bench/compare.py results/abc123-....json results/def456-....json
+
+Exits with status 1 when a scenario's p95 latency grows, or its
+throughput drops, by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline  {baseline['meta']['commit']} {baseline['meta'].get('label', '')}")
+    print(f"candidate {candidate['meta']['commit']} {candidate['meta'].get('label', '')}")
+    print(f"{'scenario':12s} {'metric':16s} {'baseline':>10s} {'candidate':>10s} {'change':>8s}")
+
+    regressions = []
+    for name, new in candidate['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        rows = [
+            ('p50_ms', old['latency_ms']['p50'], new['latency_ms']['p50'], +1),
+            ('p95_ms', old['latency_ms']['p95'], new['latency_ms']['p95'], +1),
+            ('p99_ms', old['latency_ms']['p99'], new['latency_ms']['p99'], +1),
+            ('throughput_rps', old['throughput_rps'], new['throughput_rps'], -1),
+            ('rss_peak_mb', (old.get('rss_mb') or {}).get('peak'), (new.get('rss_mb') or {}).get('peak'), +1),
+        ]
+        for metric, old_value, new_value, worse_sign in rows:
+            pct = change(old_value, new_value)
+            pct_text = f"{pct:+7.1f}%" if pct is not None else '     n/a'
+            print(f"{name:12s} {metric:16s} {old_value!s:>10s} {new_value!s:>10s} {pct_text}")
+            if metric in ('p95_ms', 'throughput_rps') and pct is not None and pct * worse_sign > args.threshold:
+                regressions.append(f"{name} {metric} {pct:+.1f}%")
+
+    if regressions:
+        print("\nRegressions over threshold:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
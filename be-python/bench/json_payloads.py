@@ -0,0 +1,138 @@
+"""Encode time and wire size of message-history payloads, before and after responses.py.
+
+Builds synthetic chat histories (short user questions, long Indonesian
+answers of about --answer-words words) and times:
+
+- encoding with Flask's default stdlib settings (sorted keys, ASCII
+  escapes, compact) vs orjson, when installed;
+- the body size uncompressed, gzip (COMPRESS_LEVEL) and brotli
+  (COMPRESS_BROTLI_QUALITY, when installed), and the time to compress.
+
+    python bench/json_payloads.py --messages 20,200,2000
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import BACKEND_DIR, git_commit  # noqa: E402
+
+sys.path.insert(0, BACKEND_DIR)
+from config import Config  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WORDS = (
+    "padi jagung cabai kedelai pupuk kompos urea hama wereng penggerek batang daun menguning tanah "
+    "sawah irigasi musim hujan kemarau benih varietas unggul panen hektar tanam jarak petani lahan "
+    "pestisida organik nabati semprot dosis liter air pagi sore gejala penyakit jamur bakteri akar "
+    "dan yang untuk dengan pada agar tidak bisa dapat lebih juga sebaiknya lakukan gunakan hindari"
+).split()
+QUESTIONS = [
+    "Bagaimana cara mengatasi hama wereng pada padi?",
+    "Kapan waktu yang tepat untuk memupuk jagung?",
+    "Apa penyebab daun cabai menguning?",
+]
+
+
+def answer(rng, words):
+    lines = []
+    for i in range(0, words, 40):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(min(40, words - i)))
+        lines.append(f"{i // 40 + 1}. *{sentence.capitalize()}*." if i % 120 == 0 else sentence.capitalize() + ".")
+    return "\n".join(lines)
+
+
+def history(count, answer_words, seed):
+    rng = random.Random(seed)
+    session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    timestamp = 1_700_000_000_000
+    messages = []
+    for i in range(count):
+        user = i % 2 == 0
+        messages.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "session_id": session_id,
+            "content": rng.choice(QUESTIONS) if user else answer(rng, answer_words),
+            "role": "user" if user else "assistant",
+            "timestamp": timestamp + i,
+            "image_path": None,
+            "audio_path": f"/uploads/audio/{rng.getrandbits(256):064x}" if user and i % 4 == 0 else None,
+        })
+    return messages
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(min(times), 3), round(statistics.median(times), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', default='20,200,2000', help="history lengths")
+    parser.add_argument('--answer-words', type=int, default=700, help="about 1000 tokens")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'bench', 'results'))
+    args = parser.parse_args()
+
+    encoders = {'stdlib': lambda obj: json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')}
+    if orjson is not None:
+        encoders['orjson'] = lambda obj: orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    compressors = {'gzip': lambda body: gzip.compress(body, compresslevel=Config.COMPRESS_LEVEL)}
+    if brotli is not None:
+        compressors['br'] = lambda body: brotli.compress(body, quality=Config.COMPRESS_BROTLI_QUALITY)
+    missing = [name for name, module in (('orjson', orjson), ('brotli', brotli)) if module is None]
+    if missing:
+        print(f"Not installed, skipped: {', '.join(missing)}")
+
+    results = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec='seconds'),
+                 "args": vars(args)},
+        "payloads": [],
+    }
+    print(f"{'messages':>8s} {'encoder':8s} {'encode ms':>10s} {'bytes':>10s} "
+          + " ".join(f"{name + ' bytes':>11s} {name + ' ms':>8s}" for name in compressors))
+    for count in (int(n) for n in args.messages.split(',')):
+        messages = history(count, args.answer_words, args.seed)
+        for name, encode in encoders.items():
+            body = encode(messages)
+            best, median = best_ms(lambda: encode(messages), args.repeat)
+            row = {"messages": count, "encoder": name, "encode_ms": best, "encode_ms_median": median,
+                   "bytes": len(body), "compressed": {}}
+            for codec, compress in compressors.items():
+                compressed = compress(body)
+                row["compressed"][codec] = {"bytes": len(compressed),
+                                            "ms": best_ms(lambda: compress(body), max(3, args.repeat // 4))[0]}
+            results["payloads"].append(row)
+            print(f"{count:8d} {name:8s} {best:10.2f} {len(body):10d} "
+                  + " ".join(f"{c['bytes']:11d} {c['ms']:8.2f}" for c in row["compressed"].values()))
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}-json-payloads.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
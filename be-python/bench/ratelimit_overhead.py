@@ -0,0 +1,124 @@
+"""Cost of the rate limiter (ratelimit.py) per request.
+
+- store: one MemoryStore.take() with 1, 10k and 2 x RATELIMIT_MAX_KEYS
+  distinct client keys (at most --calls; past RATELIMIT_MAX_KEYS every
+  call also evicts), from one thread and from --threads threads sharing
+  the store; and one RedisStore.take() round trip with --redis-url.
+- request: a Flask test-client GET on a trivial /api/sessions route,
+  without the limiter, with it letting every request through, and with
+  it rejecting every request (429).
+
+    python bench/ratelimit_overhead.py --calls 200000 --redis-url redis://localhost:6379/15
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import BACKEND_DIR, git_commit  # noqa: E402
+
+sys.path.insert(0, BACKEND_DIR)
+from flask import Flask, jsonify  # noqa: E402
+
+from config import Config  # noqa: E402
+from ratelimit import MemoryStore, RateLimiter, RedisStore  # noqa: E402
+
+RATE, BURST = 1e9, 1_000_000  # never empties: measures the allow path
+
+
+def store_ns(store, calls, keys, threads=1):
+    """Median ns per take() over 5 runs"""
+    names = [f"cheap:c:10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(keys)]
+    per_thread = calls // threads
+
+    def work(offset):
+        take = store.take
+        for i in range(offset, offset + per_thread):
+            take(names[i % len(names)], RATE, BURST)
+
+    runs = []
+    for _ in range(5):
+        workers = [threading.Thread(target=work, args=(t * per_thread,)) for t in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        runs.append((time.perf_counter() - start) * 1e9 / (per_thread * threads))
+    return round(statistics.median(runs))
+
+
+def request_us(mode, calls):
+    """Median microseconds per test-client request"""
+    class BenchConfig(Config):
+        TESTING = True
+        RATELIMIT_ENABLED = mode != 'off'
+        RATELIMIT_STORAGE_URL = ''
+        RATELIMIT_CHEAP_RATE = RATE if mode != 'reject' else 1e-9
+        RATELIMIT_CHEAP_BURST = BURST if mode != 'reject' else 1
+
+    app = Flask(__name__)
+    app.config.from_object(BenchConfig)
+    RateLimiter().init_app(app)
+
+    @app.route('/api/sessions')
+    def sessions():
+        return jsonify([])
+
+    client = app.test_client()
+    client.get('/api/sessions')  # the one token of the 'reject' bucket
+    runs = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(calls):
+            client.get('/api/sessions')
+        runs.append((time.perf_counter() - start) * 1e6 / calls)
+    return round(statistics.median(runs), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200_000, help="take() calls per store run")
+    parser.add_argument('--requests', type=int, default=5_000, help="test-client requests per run")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--redis-url', default=None)
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'bench', 'results'))
+    args = parser.parse_args()
+
+    results = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec='seconds'),
+                 "args": vars(args)},
+        "store_ns": {},
+        "request_us": {},
+    }
+    for keys in (1, 10_000, min(2 * Config.RATELIMIT_MAX_KEYS, args.calls)):
+        for threads in (1, args.threads):
+            ns = store_ns(MemoryStore(Config.RATELIMIT_MAX_KEYS), args.calls, keys, threads)
+            results["store_ns"][f"memory keys={keys} threads={threads}"] = ns
+            print(f"memory  keys={keys:>9d} threads={threads:2d} {ns:8d} ns/take")
+    if args.redis_url:
+        ns = store_ns(RedisStore(args.redis_url, prefix='ratelimit-bench:'), min(args.calls, 20_000), 10_000)
+        results["store_ns"]["redis keys=10000 threads=1"] = ns
+        print(f"redis   keys={10_000:>9d} threads= 1 {ns:8d} ns/take")
+
+    for mode in ('off', 'allow', 'reject'):
+        us = request_us(mode, args.requests)
+        results["request_us"][mode] = us
+        print(f"request limiter={mode:6s} {us:8.1f} us")
+    overhead = results["request_us"]["allow"] - results["request_us"]["off"]
+    print(f"limiter overhead per allowed request: {overhead:.1f} us")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}-ratelimit.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""Offline benchmark for the PeTaniku backend.
+
+Starts local DeepSeek/OpenWeather stand-ins, launches the Flask app
+against them and drives concurrent load at each endpoint. It reports
+p50/p95/p99 latency, throughput and server RSS, and writes a JSON result
+file that ``compare.py`` can diff against a previous commit.
+
+    python bench/run.py --scenarios sessions,chat,weather,transcribe \\
+        --concurrency 8 --duration 30 --deepseek-latency 0.8
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs  # noqa: E402
+from audio_fixtures import generate_clips  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SERVER_CMD = "gunicorn -w {workers} -b 127.0.0.1:{port} --timeout 300 app:create_app()"
+
+QUESTIONS = [
+    "Bagaimana cara mengatasi hama wereng pada padi?",
+    "Kapan waktu yang tepat untuk memupuk jagung?",
+    "Apa penyebab daun cabai menguning?",
+    "Berapa jarak tanam ideal untuk kedelai?",
+    "Bagaimana cara membuat pupuk kompos dari jerami?",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank method
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def process_tree_rss(pid):
+    """Total RSS in bytes of a process and its direct children"""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.samples.append(process_tree_rss(self.pid))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        if not self.samples:
+            return {"peak": None, "mean": None}
+        mb = [s / (1024 * 1024) for s in self.samples]
+        return {"peak": round(max(mb), 1), "mean": round(sum(mb) / len(mb), 1)}
+
+
+class Server:
+    def __init__(self, cmd, env, startup_timeout):
+        self.cmd = cmd
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.proc = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(shlex.split(self.cmd), cwd=BACKEND_DIR, env=self.env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.proc.returncode}: {self.cmd}")
+            try:
+                if requests.get(f"{self.env['BENCH_BASE_URL']}/", timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"Server did not come up within {self.startup_timeout}s")
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# Scenarios: each returns a callable issuing one request with a per-thread requests.Session
+
+def scenario_sessions(base_url, context):
+    def call(http):
+        return http.get(f"{base_url}/api/sessions", timeout=60)
+    return call
+
+
+def scenario_weather(base_url, context):
+    def call(http):
+        lat = -6.6 + random.uniform(-0.5, 0.5)
+        lon = 106.8 + random.uniform(-0.5, 0.5)
+        return http.get(f"{base_url}/api/weather", params={"lat": lat, "lon": lon}, timeout=60)
+    return call
+
+
+def scenario_chat(base_url, context):
+    def call(http):
+        return http.post(f"{base_url}/api/chat", json={
+            "message": random.choice(QUESTIONS),
+            "session_id": random.choice(context['session_ids'])
+        }, timeout=120)
+    return call
+
+
+def scenario_transcribe(base_url, context):
+    clips = context['clips']
+
+    def call(http):
+        path, _ = random.choice(clips)
+        with open(path, 'rb') as f:
+            return http.post(f"{base_url}/api/transcribe",
+                             files={"audio": (os.path.basename(path), f, 'audio/wav')},
+                             data={"session_id": random.choice(context['session_ids'])},
+                             timeout=600)
+    return call
+
+
+SCENARIOS = {
+    'sessions': scenario_sessions,
+    'weather': scenario_weather,
+    'chat': scenario_chat,
+    'transcribe': scenario_transcribe,
+}
+
+
+def drive(call, concurrency, duration, max_requests=None):
+    """Jalankan beban konkuren dan kumpulkan latensi per request"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    issued = [0]
+
+    def worker():
+        http = requests.Session()
+        while time.monotonic() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            start = time.perf_counter()
+            try:
+                response = call(http)
+                ok = response.status_code < 400
+                status = response.status_code
+            except requests.RequestException as e:
+                ok, status = False, type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def summarize(latencies, errors, wall):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    status_counts = {}
+    for status in errors:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    return {
+        "requests": len(values) + len(errors),
+        "ok": len(values),
+        "errors": status_counts,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(values) / wall, 3) if wall else None,
+        "latency_ms": {
+            "p50": ms(percentile(values, 50)),
+            "p95": ms(percentile(values, 95)),
+            "p99": ms(percentile(values, 99)),
+            "mean": ms(sum(values) / len(values)) if values else None,
+            "max": ms(values[-1]) if values else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='sessions,weather,chat,transcribe')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help="seconds per scenario")
+    parser.add_argument('--max-requests', type=int, default=None, help="cap per scenario")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds of unrecorded load per scenario")
+    parser.add_argument('--workers', type=int, default=2, help="server worker processes")
+    parser.add_argument('--server-cmd', default=DEFAULT_SERVER_CMD,
+                        help="command to start the app; {port} and {workers} are substituted")
+    parser.add_argument('--base-url', default=None, help="benchmark an already running server instead")
+    parser.add_argument('--deepseek-latency', type=float, default=0.8)
+    parser.add_argument('--deepseek-jitter', type=float, default=0.2)
+    parser.add_argument('--deepseek-token-delay', type=float, default=0.0, help="per-token delay when streaming")
+    parser.add_argument('--openweather-latency', type=float, default=0.15)
+    parser.add_argument('--whisper-model', default='tiny')
+    parser.add_argument('--clips', type=int, default=20)
+    parser.add_argument('--clip-dir', default=os.path.join(BACKEND_DIR, 'bench', '.clips'))
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--startup-timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--label', default='', help="free-form tag stored with the results")
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'bench', 'results'))
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    deepseek = stubs.start_deepseek(latency=args.deepseek_latency, jitter=args.deepseek_jitter,
+                                    token_delay=args.deepseek_token_delay)
+    openweather = stubs.start_openweather(latency=args.openweather_latency)
+
+    context = {}
+    if 'transcribe' in scenarios:
+        print(f"Preparing {args.clips} synthetic clips in {args.clip_dir} ...")
+        context['clips'] = generate_clips(args.clip_dir, args.clips, args.seed)
+
+    port = free_port()
+    base_url = args.base_url or f"http://127.0.0.1:{port}"
+    env = dict(os.environ,
+               DEEPSEEK_API_URL=deepseek.url,
+               OPENWEATHER_API_URL=openweather.url,
+               DEEPSEEK_API_KEY='bench',
+               OPENWEATHER_API_KEY='bench',
+               WHISPER_MODEL_NAME=args.whisper_model,
+               RATELIMIT_ENABLED='false',  # all load comes from one address
+               BENCH_BASE_URL=base_url)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "label": args.label,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+
+    server = None
+    if not args.base_url:
+        server = Server(args.server_cmd.format(port=port, workers=args.workers), env, args.startup_timeout)
+        server.__enter__()
+        results["meta"]["startup_rss_mb"] = round(process_tree_rss(server.proc.pid) / (1024 * 1024), 1)
+    try:
+        http = requests.Session()
+        context['session_ids'] = [
+            http.post(f"{base_url}/api/sessions", json={"name": f"bench {i}"}, timeout=30).json()['id']
+            for i in range(args.sessions)
+        ]
+
+        for name in scenarios:
+            call = SCENARIOS[name](base_url, context)
+            deepseek.request_count = openweather.request_count = 0
+            if args.warmup:
+                drive(call, args.concurrency, args.warmup)
+            sampler = RssSampler(server.proc.pid) if server else None
+            if sampler:
+                sampler.start()
+            latencies, errors, wall = drive(call, args.concurrency, args.duration, args.max_requests)
+            summary = summarize(latencies, errors, wall)
+            summary["rss_mb"] = sampler.stop() if sampler else None
+            summary["upstream_calls"] = {"deepseek": deepseek.request_count, "openweather": openweather.request_count}
+            results["scenarios"][name] = summary
+            lat = summary["latency_ms"]
+            print(f"{name:12s} ok={summary['ok']:6d} err={sum(summary['errors'].values()):4d} "
+                  f"rps={summary['throughput_rps']:8.2f} p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} ms "
+                  f"rss_peak={summary['rss_mb'] and summary['rss_mb']['peak']} MB")
+    finally:
+        if server:
+            server.__exit__(None, None, None)
+        deepseek.shutdown()
+        openweather.shutdown()
+
+    os.makedirs(args.out, exist_ok=True)
+    suffix = f"-{args.label}" if args.label else ''
+    path = os.path.join(args.out, f"{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}{suffix}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
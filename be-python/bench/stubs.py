@@ -0,0 +1,141 @@
+"""Local stand-ins for the DeepSeek and OpenWeather APIs.
+
+Both servers answer instantly apart from the configured latency, so the
+benchmark measures our own code and not the internet.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_ANSWER = (
+    "Untuk tanaman padi pada musim hujan, pastikan saluran drainase sawah berfungsi baik "
+    "agar air tidak menggenang terlalu lama. Lakukan pemupukan *urea* secara bertahap, "
+    "pantau serangan wereng coklat setiap pagi, dan gunakan varietas tahan genangan "
+    "seperti Inpari 30 bila lahan sering tergenang.\n"
+)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, jitter=0.0, token_delay=0.0, answer_repeat=4, error_rate=0.0):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.answer = SAMPLE_ANSWER * answer_repeat
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def wait(self):
+        with self._count_lock:
+            self.request_count += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return random.random() < self.error_rate
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DeepSeekHandler(_Handler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.server.wait():
+            self.send_json(503, {"error": {"message": "stub overloaded"}})
+            return
+        if payload.get('stream'):
+            self.stream_answer()
+        else:
+            self.send_json(200, {
+                "id": "stub",
+                "object": "chat.completion",
+                "model": payload.get('model', 'deepseek-chat'),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.server.answer},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 50, "completion_tokens": len(self.server.answer.split())}
+            })
+
+    def stream_answer(self):
+        """Server-sent events in the OpenAI/DeepSeek streaming format"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def chunk(data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        for word in self.server.answer.split(' '):
+            event = {"choices": [{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}]}
+            chunk(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+        chunk(b"data: [DONE]\n\n")
+        chunk(b"")
+
+
+class OpenWeatherHandler(_Handler):
+    def do_GET(self):
+        if self.server.wait():
+            self.send_json(503, {"cod": 503, "message": "stub overloaded"})
+            return
+        self.send_json(200, {
+            "weather": [{"id": 500, "main": "Rain", "description": "hujan ringan"}],
+            "main": {"temp": 27.4, "humidity": 88},
+            "name": "Bogor",
+            "cod": 200
+        })
+
+
+def start_deepseek(**options):
+    return StubServer(DeepSeekHandler, **options).start()
+
+
+def start_openweather(**options):
+    return StubServer(OpenWeatherHandler, **options).start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    deepseek = start_deepseek(latency=args.latency, token_delay=args.token_delay)
+    openweather = start_openweather(latency=args.latency / 5)
+    print(f"DEEPSEEK_API_URL={deepseek.url}")
+    print(f"OPENWEATHER_API_URL={openweather.url}")
+    threading.Event().wait()
@@ -0,0 +1,145 @@
+"""Per-worker memory of gunicorn with the Whisper model loaded, by serving mode.
+
+Starts gunicorn with 1, 4 and 8 workers in each mode, sends enough
+transcriptions that every worker has run the model, and reads
+``/proc/<pid>/smaps_rollup`` for the master and each worker:
+
+- ``private``: every worker loads its own float32 copy (the old default);
+- ``mmap``: every worker maps the shared float32 checkpoint (WHISPER_MMAP);
+- ``preload``: the master loads the model before fork (GUNICORN_PRELOAD,
+  which implies WHISPER_MMAP), see gunicorn.conf.py.
+
+USS (Private_Clean + Private_Dirty) is what one more worker costs; the
+sum of PSS over all processes is the real total footprint.
+
+    python bench/worker_memory.py --workers 1,4,8 --whisper-model base
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs  # noqa: E402
+from audio_fixtures import generate_clips  # noqa: E402
+from run import BACKEND_DIR, Server, drive, free_port, git_commit, scenario_transcribe  # noqa: E402
+
+import requests  # noqa: E402
+
+SERVER_CMD = "gunicorn -c gunicorn.conf.py -w {workers} -b 127.0.0.1:{port} --timeout 300 app:create_app()"
+MODES = {
+    'private': {'WHISPER_PRELOAD': 'true', 'WHISPER_MMAP': 'false', 'GUNICORN_PRELOAD': 'false'},
+    'mmap': {'WHISPER_PRELOAD': 'true', 'WHISPER_MMAP': 'true', 'GUNICORN_PRELOAD': 'false'},
+    'preload': {'WHISPER_PRELOAD': 'true', 'WHISPER_MMAP': 'true', 'GUNICORN_PRELOAD': 'true'},
+}
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def smaps_rollup(pid):
+    """Field smaps_rollup yang dipakai, dalam MiB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in SMAPS_FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    values['Uss'] = values['Private_Clean'] + values['Private_Dirty']
+    return values
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def wait_for_workers(pid, workers, timeout, settle=3):
+    """Tunggu sampai semua worker hidup dan RSS-nya berhenti naik"""
+    deadline = time.monotonic() + timeout
+    previous, stable = None, 0
+    while time.monotonic() < deadline:
+        pids = children(pid)
+        if len(pids) == workers:
+            rss = [smaps_rollup(p)['Rss'] for p in pids]
+            stable = stable + 1 if previous and all(abs(a - b) < 1 for a, b in zip(rss, previous)) else 0
+            if stable >= settle:
+                return pids
+            previous = rss
+        time.sleep(1)
+    raise RuntimeError(f"{workers} workers did not settle within {timeout}s")
+
+
+def measure(mode, workers, args, env, clips):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(env, **MODES[mode], BENCH_BASE_URL=base_url)
+    with Server(SERVER_CMD.format(workers=workers, port=port), env, args.startup_timeout) as server:
+        wait_for_workers(server.proc.pid, workers, args.startup_timeout)
+        session_id = requests.post(f"{base_url}/api/sessions", json={"name": "memory"}, timeout=30).json()['id']
+        # Enough concurrent transcriptions that each worker runs the model at least once
+        call = scenario_transcribe(base_url, {'clips': clips, 'session_ids': [session_id]})
+        drive(call, workers * 2, duration=600, max_requests=workers * args.requests_per_worker)
+        pids = wait_for_workers(server.proc.pid, workers, args.startup_timeout)
+
+        master = smaps_rollup(server.proc.pid)
+        per_worker = [smaps_rollup(pid) for pid in pids]
+    mean = {field: round(sum(w[field] for w in per_worker) / workers, 1) for field in per_worker[0]}
+    return {
+        "workers": workers,
+        "master": {field: round(value, 1) for field, value in master.items()},
+        "worker_mean": mean,
+        "worker_uss_max": round(max(w['Uss'] for w in per_worker), 1),
+        "total_pss": round(master['Pss'] + sum(w['Pss'] for w in per_worker), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--workers', default='1,4,8', help="worker counts to measure")
+    parser.add_argument('--whisper-model', default='base')
+    parser.add_argument('--requests-per-worker', type=int, default=4)
+    parser.add_argument('--clip-dir', default=os.path.join(BACKEND_DIR, 'bench', '.clips'))
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'bench', 'results'))
+    args = parser.parse_args()
+
+    deepseek = stubs.start_deepseek(latency=0.1)
+    openweather = stubs.start_openweather(latency=0.1)
+    clips = [clip for clip in generate_clips(args.clip_dir, 8) if clip[1] <= 10]
+    env = dict(os.environ, DEEPSEEK_API_URL=deepseek.url, OPENWEATHER_API_URL=openweather.url,
+               DEEPSEEK_API_KEY='bench', OPENWEATHER_API_KEY='bench', WHISPER_MODEL_NAME=args.whisper_model,
+               AUDIO_GC_INTERVAL='0', RATELIMIT_ENABLED='false')
+    results = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec='seconds'),
+                 "cpu_count": os.cpu_count(), "args": vars(args)},
+        "modes": {},
+    }
+
+    print(f"{'mode':8s} {'workers':>7s} {'USS/worker':>11s} {'PSS/worker':>11s} {'RSS/worker':>11s} "
+          f"{'master USS':>11s} {'total PSS':>10s}  (MiB)")
+    for mode in args.modes.split(','):
+        results["modes"][mode] = []
+        for workers in (int(n) for n in args.workers.split(',')):
+            row = measure(mode, workers, args, env, clips)
+            results["modes"][mode].append(row)
+            mean = row['worker_mean']
+            print(f"{mode:8s} {workers:7d} {mean['Uss']:11.1f} {mean['Pss']:11.1f} {mean['Rss']:11.1f} "
+                  f"{row['master']['Uss']:11.1f} {row['total_pss']:10.1f}")
+
+    deepseek.shutdown()
+    openweather.shutdown()
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{results['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}-worker-memory.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
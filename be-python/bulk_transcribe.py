@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Bulk (re-)transcription of stored audio.
+
+Walks either the ``messages.audio_path`` column (``--from-db``; the new
+text is written back to the messages that reference each file) or a
+directory of audio files (``--dir``; results go to a JSONL file). Files
+are decoded in batches by a pool of worker processes, each with its own
+copy of the model. Finished files are checkpointed after every write, so
+a stopped run resumes where it left off.
+
+    python bulk_transcribe.py --from-db --model small --workers 4
+    python bulk_transcribe.py --dir uploads/audio --out transcripts.jsonl
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.opus', '.ogg', '.mp3', '.m4a', '.webm', '.flac')
+
+_engine = None
+
+
+def _init_worker(config, threads):
+    global _engine
+    import torch
+    torch.set_num_threads(threads)
+
+    from inference import WhisperEngine
+    _engine = WhisperEngine()
+    _engine.configure(config)
+    _engine.load()
+
+
+def _transcribe(batch, language):
+    """Transkripsi satu batch [(key, path)] di proses worker"""
+    try:
+        results = _engine.transcribe_batch([path for _, path in batch], language=language)
+    except Exception:
+        # One bad file shouldn't sink the whole batch; retry them one at a time
+        results = []
+        for _, path in batch:
+            try:
+                results.extend(_engine.transcribe_batch([path], language=language))
+            except Exception as e:
+                results.append({"error": str(e)})
+    return [(key, result) for (key, _), result in zip(batch, results)]
+
+
+class Checkpoint:
+    """Kunci file yang sudah selesai, satu per baris; ditambah setelah tiap penulisan.
+
+    The first line records the model and language the keys were done
+    with. A checkpoint from a different run setup is refused, so a
+    re-run with a bigger model doesn't skip what the old one finished.
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.header = f"# {run}"
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [line.rstrip('\n') for line in f if line.strip()]
+            if lines and lines[0] != self.header:
+                written_for = lines[0][2:] if lines[0].startswith('# ') else 'an unrecorded model'
+                raise ValueError(f"Checkpoint {path} was written for {written_for}, "
+                                 f"not {run}; pass a different --checkpoint or delete it")
+            self.done = set(lines[1:])
+        else:
+            with open(path, 'w') as f:
+                f.write(f"{self.header}\n")
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, keys):
+        with open(self.path, 'a') as f:
+            for key in keys:
+                f.write(f"{key}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(keys)
+
+
+def files_from_dir(root):
+    """{key: path} untuk semua file audio di bawah root"""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                files[os.path.relpath(path, root)] = path
+    return files
+
+
+def files_from_db(audio_store, session_id=None):
+    """({key: path}, {key: [(message_id, session_id, content)]}) for user messages with audio"""
+    from models import Message, db
+
+    query = db.session.query(Message.id, Message.session_id, Message.content, Message.audio_path) \
+        .filter(Message.audio_path.isnot(None), Message.role == 'user')
+    if session_id:
+        query = query.filter(Message.session_id == session_id)
+
+    files, messages, missing = {}, {}, 0
+    for row in query.all():
+        key = row.audio_path.rsplit('/', 1)[-1]
+        if key not in files:
+            path, _, _ = audio_store.resolve(key)
+            if not path:
+                missing += 1
+                continue
+            files[key] = path
+        messages.setdefault(key, []).append((row.id, row.session_id, row.content))
+    db.session.rollback()
+    if missing:
+        logger.warning(f"{missing} audio files referenced by messages were not found")
+    return files, messages
+
+
+def write_messages(results, messages):
+    """Update pesan untuk satu kelompok hasil dalam satu transaksi"""
+    from models import Message, Session, db, record_change, refresh_summary
+
+    mappings, sessions = [], set()
+    for key, result in results:
+        text = result.get('text')
+        if not text:
+            continue
+        for message_id, session_id, content in messages.get(key, ()):
+            if content != text:
+                mappings.append({'id': message_id, 'content': text})
+                record_change('message', message_id, 'update', session_id)
+                sessions.add(session_id)
+    db.session.bulk_update_mappings(Message, mappings)
+    # The new text may be a session's last message, shown in the session list
+    for session_id in sessions:
+        session = db.session.get(Session, session_id)
+        if session is not None:
+            refresh_summary(session)
+            record_change('session', session_id, 'update', session_id)
+    db.session.commit()
+    return len(mappings)
+
+
+def write_jsonl(results, out):
+    for key, result in results:
+        out.write(json.dumps({"file": key, **result}, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-db', action='store_true', help="re-transcribe audio referenced by messages")
+    source.add_argument('--dir', help="transcribe every audio file under this directory")
+    parser.add_argument('--session', help="only messages of this session (with --from-db)")
+    parser.add_argument('--out', default='transcripts.jsonl', help="results file (with --dir)")
+    parser.add_argument('--model', default=Config.WHISPER_MODEL_NAME)
+    parser.add_argument('--language', help="skip detection and decode everything in this language")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument('--threads', type=int, help="torch threads per worker (default: cores / workers)")
+    parser.add_argument('--batch-size', type=int, default=Config.WHISPER_BATCH_SIZE)
+    parser.add_argument('--commit-every', type=int, default=200, help="files per DB transaction / checkpoint")
+    parser.add_argument('--checkpoint', help="default: <out>.<model>-<language>.done or bulk_transcribe.<model>-<language>.done")
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    app = None
+    if args.from_db:
+        from app import audio_store, create_app
+        app = create_app()
+        with app.app_context():
+            files, messages = files_from_db(audio_store, args.session)
+    else:
+        files, messages = files_from_dir(args.dir), {}
+
+    run = f"model={args.model} language={args.language or 'auto'}"
+    # Named after the run setup, so a re-run with another model starts its own checkpoint
+    default_checkpoint = f"{args.out if args.dir else 'bulk_transcribe'}.{args.model}-{args.language or 'auto'}.done"
+    try:
+        checkpoint = Checkpoint(args.checkpoint or default_checkpoint, run)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    # Similar sizes batch together, so no clip waits on a much longer one's decode
+    pending = sorted((key for key in files if key not in checkpoint), key=lambda key: os.path.getsize(files[key]))
+    if args.limit:
+        pending = pending[:args.limit]
+    logger.info(f"{len(files)} files, {len(files) - len(pending)} already done, {len(pending)} to go")
+    if not pending:
+        return True
+
+    config = {name: getattr(Config, name) for name in dir(Config) if name.startswith('WHISPER_')}
+    config['WHISPER_MODEL_NAME'] = args.model
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    batches = [[(key, files[key]) for key in pending[i:i + args.batch_size]]
+               for i in range(0, len(pending), args.batch_size)]
+
+    out = open(args.out, 'a', encoding='utf-8') if args.dir else None
+    started = time.perf_counter()
+    audio_seconds, done, errors, updated = 0.0, 0, 0, 0
+    buffered = []
+
+    def flush():
+        nonlocal updated
+        if not buffered:
+            return
+        if app is not None:
+            with app.app_context():
+                updated += write_messages(buffered, messages)
+        else:
+            write_jsonl(buffered, out)
+        checkpoint.add([key for key, result in buffered if 'error' not in result])
+        buffered.clear()
+
+    # spawn, not fork: each worker imports torch and loads its own model cleanly
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(config, threads)) as pool:
+            futures = [pool.submit(_transcribe, batch, args.language) for batch in batches]
+            for future in as_completed(futures):
+                for key, result in future.result():
+                    done += 1
+                    if 'error' in result:
+                        errors += 1
+                        logger.error(f"Failed to transcribe {key}: {result['error']}")
+                        continue
+                    audio_seconds += result['duration']
+                    buffered.append((key, result))
+                if len(buffered) >= args.commit_every:
+                    flush()
+                wall = time.perf_counter() - started
+                logger.info(f"{done}/{len(pending)} files, {audio_seconds / 3600:.2f} h audio in {wall / 60:.1f} min "
+                            f"({audio_seconds / wall:.1f} audio-hours per wall-hour)")
+    finally:
+        flush()
+        if out:
+            out.close()
+
+    wall = time.perf_counter() - started
+    print(f"files: {done} ({errors} failed)")
+    print(f"audio: {audio_seconds / 3600:.2f} h, wall: {wall / 3600:.2f} h")
+    print(f"throughput: {audio_seconds / wall:.1f} audio-hours per wall-hour "
+          f"({args.workers} workers x {threads} threads, model {args.model})")
+    if app is not None:
+        print(f"messages updated: {updated}")
+    return errors == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
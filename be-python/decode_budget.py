@@ -0,0 +1,93 @@
+"""Bounded Whisper decoding.
+
+Each decode gets a token budget derived from the clip's duration and the
+word cap, and a logit filter that forces end-of-text as soon as the
+output starts looping (a repeated n-gram or a compression ratio like the
+one ``whisper.transcribe`` uses to detect hallucinations). Decoder steps
+are counted, so the worst-case cost of a request is bounded and visible.
+
+The duration budget assumes fast speech (WORDS_PER_SECOND) with
+BUDGET_HEADROOM on top, so ordinary speech is never cut off by it. A row
+that still runs out of budget is reported separately from one stopped
+for looping: EarlyStop.truncated vs EarlyStop.stopped.
+"""
+import math
+
+from whisper.decoding import DecodingTask, LogitFilter
+from whisper.utils import compression_ratio
+
+TOKENS_PER_WORD = 3.0  # Indonesian/Javanese words are often split into several BPE tokens
+WORDS_PER_SECOND = 4.0  # fast conversational Indonesian; typical speech is 2-3
+BUDGET_HEADROOM = 1.25
+MIN_TOKENS = 16
+MAX_PREFIX_TOKENS = 8  # start-of-transcript, language, task and timestamp tokens before the sample
+MAX_NGRAM = 8
+MIN_REPEATED_SPAN = 8  # tokens; "ya ya" is fine, eight of them isn't
+COMPRESSION_CHECK_EVERY = 8  # steps
+COMPRESSION_MIN_TOKENS = 32
+
+
+def token_budget(duration, n_text_ctx, max_words=250, words_per_second=WORDS_PER_SECOND):
+    """Jumlah token maksimum untuk satu jendela audio"""
+    # Whisper's default of n_text_ctx // 2 holds only ~75 Indonesian words per 30 s window
+    limit = n_text_ctx - MAX_PREFIX_TOKENS
+    by_duration = math.ceil((duration or 30.0) * words_per_second * TOKENS_PER_WORD * BUDGET_HEADROOM)
+    by_words = math.ceil(max_words * TOKENS_PER_WORD) if max_words else limit
+    return max(MIN_TOKENS, min(limit, by_duration, by_words))
+
+
+def repeats_tail(tokens):
+    """True if the sequence ends in the same n-gram repeated back to back"""
+    for n in range(1, MAX_NGRAM + 1):
+        repeats = max(3, math.ceil(MIN_REPEATED_SPAN / n))
+        span = n * repeats
+        if len(tokens) < span:
+            break
+        tail = tokens[-span:]
+        if tail == tail[:n] * repeats:
+            return True
+    return False
+
+
+class EarlyStop(LogitFilter):
+    """Force end-of-text on rows whose output loops; counts decoder steps"""
+
+    def __init__(self, tokenizer, sample_begin, compression_threshold=2.4):
+        self.tokenizer = tokenizer
+        self.sample_begin = sample_begin
+        self.compression_threshold = compression_threshold
+        self.steps = 0
+        self.stopped = set()  # rows ended because they were looping
+        self.truncated = set()  # rows that used up the whole token budget, filled in by decode()
+
+    def _looping(self, sampled):
+        text_tokens = [t for t in sampled if t < self.tokenizer.timestamp_begin]
+        if repeats_tail(text_tokens):
+            return True
+        if (self.compression_threshold and len(text_tokens) >= COMPRESSION_MIN_TOKENS
+                and self.steps % COMPRESSION_CHECK_EVERY == 0):
+            return compression_ratio(self.tokenizer.decode(text_tokens)) > self.compression_threshold
+        return False
+
+    def apply(self, logits, tokens):
+        self.steps += 1
+        for row in range(tokens.shape[0]):
+            sampled = tokens[row, self.sample_begin:].tolist()
+            if sampled and sampled[-1] == self.tokenizer.eot:
+                continue
+            if row in self.stopped or self._looping(sampled):
+                self.stopped.add(row)
+                logits[row, :] = -math.inf
+                logits[row, self.tokenizer.eot] = 0
+
+
+def decode(model, features, options, compression_threshold=2.4):
+    """whisper.decode with the early-stop filter; returns (results, EarlyStop)"""
+    task = DecodingTask(model, options)
+    early_stop = EarlyStop(task.tokenizer, task.sample_begin, compression_threshold)
+    task.logit_filters.append(early_stop)
+    results = task.run(features)
+    # Rows cut off by sample_len carry no end-of-text of their own
+    early_stop.truncated = {row for row, result in enumerate(results)
+                            if row not in early_stop.stopped and len(result.tokens) >= task.sample_len}
+    return results, early_stop
@@ -0,0 +1,61 @@
+"""Gunicorn settings, read automatically from the working directory.
+
+Workers run GUNICORN_THREADS threads (gthread), so a long-poll on
+/api/changes holds one thread, not the whole worker; the worker's
+heartbeat keeps going while its threads wait. ``-k`` on the command
+line (the ASGI mode) still picks another worker class. The rest is
+opt-in through the environment.
+
+GUNICORN_PRELOAD=true builds the app (and loads the Whisper model) once
+in the master and forks the workers from it. Combined with WHISPER_MMAP
+the weights live in the page cache and every worker maps the same
+physical pages; what is left per worker is the Python heap it touches.
+Measure with ``python bench/worker_memory.py``.
+
+With preload the audio GC thread runs in the master only, once per host
+instead of once per worker; pooled DB connections the master opened are
+dropped in each worker by create_app's fork hook.
+"""
+import gc
+import os
+import sys
+
+# Not imported from config: this file is loaded before the app directory is on sys.path
+threads = int(os.getenv("GUNICORN_THREADS", "8"))  # > 1 turns the default sync worker into gthread
+# /api/transcribe/long decodes synchronously: allow a full-length recording decoded at
+# real time on CPU, plus the admission queue wait, before a silent worker is killed
+timeout = int(os.getenv("GUNICORN_TIMEOUT",
+                        str(int(float(os.getenv("LONGFORM_MAX_DURATION", str(15 * 60))) + 120))))
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() in ("1", "true", "yes", "on")
+
+if preload_app:
+    os.environ.setdefault("WHISPER_PRELOAD", "true")
+    os.environ.setdefault("WHISPER_MMAP", "true")
+    # No collections while the app loads in the master; what survives
+    # the load is frozen in when_ready, before the first fork
+    gc.disable()
+
+
+def when_ready(server):
+    if server.cfg.workers > 1:
+        server.log.warning(f"/metrics reports one worker per scrape ({server.cfg.workers} workers); "
+                           "run a single worker when scraping it")
+    if preload_app:
+        gc.freeze()
+        gc.enable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # Keep the preloaded objects out of the workers' collections:
+        # a collection writes to every object header it visits, which
+        # would copy those pages into each worker
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # torch defaults to one thread per core in every process
+    if preload_app and "torch" in sys.modules:
+        import torch
+        cores = os.cpu_count() or 1
+        torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", max(1, cores // server.cfg.workers))))
@@ -0,0 +1,92 @@
+"""Idempotency-Key support for endpoints that persist messages.
+
+The first request with a key claims it (a 'pending' row); the response
+is stored in the same transaction as the messages it saved, and retries
+with the same key get that stored response back instead of running and
+persisting again. A retry that arrives while the first attempt is still
+running in another worker gets 409 with Retry-After.
+"""
+import hashlib
+import json
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from audio_storage import now_ms
+from models import db, IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(*parts, session_id=None):
+    """Sidik jari request (isi + sesi); dipakai untuk coalescing dan untuk cek reuse key"""
+    raw = json.dumps([*parts, session_id or None], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def normalize_text(text):
+    return " ".join(text.split()).casefold()
+
+
+def begin(key, endpoint, request_fingerprint):
+    """Claim ``key``. Returns None to go ahead, or a (body, status, headers) response to send instead"""
+    if len(key) > MAX_KEY_LENGTH:
+        return {"error": f"{HEADER} too long (max {MAX_KEY_LENGTH})"}, 400, {}
+
+    config = current_app.config
+    now = now_ms()
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < now - config['IDEMPOTENCY_TTL'] * 1000) \
+        .delete(synchronize_session=False)
+
+    row = db.session.get(IdempotencyKey, key)
+    if row is None:
+        db.session.add(IdempotencyKey(key=key, endpoint=endpoint, fingerprint=request_fingerprint,
+                                      status='pending', created_at=now))
+    elif row.endpoint != endpoint or row.fingerprint != request_fingerprint:
+        db.session.rollback()
+        return {"error": f"{HEADER} was already used for a different request"}, 422, {}
+    elif row.status == 'done':
+        response = json.loads(row.response_body), row.response_code, {'Idempotent-Replayed': 'true'}
+        db.session.rollback()
+        return response
+    elif row.created_at >= now - config['IDEMPOTENCY_PENDING_TIMEOUT'] * 1000:
+        db.session.rollback()
+        return in_progress()
+    else:
+        row.created_at = now  # the attempt that claimed it died; take it over
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another worker claimed it first
+        return in_progress()
+    return None
+
+
+def in_progress():
+    return {"error": "A request with this Idempotency-Key is still being processed"}, 409, {'Retry-After': '1'}
+
+
+def store_response(key, status, body):
+    """Tandai key selesai di transaksi yang sedang berjalan (tanpa commit)"""
+    row = db.session.get(IdempotencyKey, key)
+    if row is not None and row.status == 'pending':
+        row.status = 'done'
+        row.response_code = status
+        row.response_body = json.dumps(body, ensure_ascii=False)
+
+
+def finish(key, status, body):
+    """Simpan respons jika belum tersimpan bersama pesan; error server melepas key agar bisa dicoba ulang"""
+    if status >= 500:
+        release(key)
+        return
+    store_response(key, status, body)
+    db.session.commit()
+
+
+def release(key):
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(key=key, status='pending').delete(synchronize_session=False)
+    db.session.commit()
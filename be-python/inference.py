@@ -0,0 +1,374 @@
+import logging
+import os
+import threading
+import time
+
+from admission import AdmissionController, model_cost
+from metrics import observe_whisper
+
+logger = logging.getLogger(__name__)
+
+
+class WhisperEngine:
+    """Owns the Whisper model for the process.
+
+    ``whisper`` (and with it torch) is only imported when the model is
+    first needed, so endpoints that never touch audio don't pay for it
+    at startup.
+    """
+
+    def __init__(self):
+        self.model_name = None
+        self.mmap = False
+        self._model = None
+        self._lock = threading.Lock()
+        self.admission = AdmissionController('whisper')
+        self.languages = ('id', 'jw', 'su')
+        self.min_avg_logprob = -1.0
+        self.max_words = 250
+        self.words_per_second = 4.0
+        self.compression_threshold = 2.4
+        self.batch_size = 8
+
+    def init_app(self, app):
+        self.configure(app.config)
+        app.extensions['whisper_engine'] = self
+        if app.config.get('WHISPER_PRELOAD'):
+            try:
+                self.load()
+            except Exception:
+                pass  # already logged, retried on first transcription
+
+    def configure(self, config):
+        """Apply Whisper settings from a Flask config or any mapping (bulk workers have no app)"""
+        self.model_name = config['WHISPER_MODEL_NAME']
+        self.mmap = config.get('WHISPER_MMAP', False)
+        self.languages = tuple(config['WHISPER_LANGUAGES'])
+        self.min_avg_logprob = config['WHISPER_MIN_AVG_LOGPROB']
+        self.max_words = config['WHISPER_MAX_WORDS']
+        self.words_per_second = config['WHISPER_WORDS_PER_SECOND']
+        self.compression_threshold = config['WHISPER_COMPRESSION_RATIO_THRESHOLD']
+        self.batch_size = config['WHISPER_BATCH_SIZE']
+        self.admission = AdmissionController(
+            'whisper',
+            max_concurrent=config['WHISPER_MAX_CONCURRENCY'],
+            max_queue=config['WHISPER_MAX_QUEUE'],
+            max_wait=config['WHISPER_MAX_QUEUE_WAIT'],
+            scheduler=config['WHISPER_SCHEDULER'],
+            cost_factor=model_cost(self.model_name),
+            aging=config['WHISPER_SJF_AGING'],
+        )
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Muat model Whisper sekali per proses (thread-safe)"""
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                try:
+                    import torch
+                    import whisper
+                    if self.mmap and not torch.cuda.is_available():
+                        self._model = self._load_mapped()
+                    else:
+                        self._model = whisper.load_model(self.model_name)
+                    logger.info(f"Whisper model '{self.model_name}' loaded in {time.perf_counter() - start:.1f}s")
+                except Exception as e:
+                    logger.error(f"Failed to load Whisper model: {e}")
+                    raise
+        return self._model
+
+    def _load_mapped(self):
+        """Load the CPU model with its weights memory-mapped from a float32 checkpoint.
+
+        Whisper's published checkpoints are float16 and ``load_model``
+        copies them into float32 parameters on the heap, so every process
+        ends up with private pages. Here the float32 weights are written
+        once next to Whisper's download cache (``<name>.fp32.pt``) and
+        loaded with ``torch.load(mmap=True)``: the parameters point into
+        the page cache, which all workers on the host share, whether they
+        are forked from a preloading master (see gunicorn.conf.py) or not.
+        Falls back to ``whisper.load_model`` on torch < 2.1.
+        """
+        import torch
+        import whisper
+        from whisper.model import ModelDimensions, Whisper
+
+        path = self._mapped_checkpoint()
+        try:
+            checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        except TypeError:
+            logger.warning("torch.load(mmap=True) needs torch>=2.1; loading Whisper weights privately")
+            return whisper.load_model(self.model_name, device='cpu')
+
+        model = Whisper(ModelDimensions(**checkpoint['dims']))
+        # assign=True keeps the mapped tensors instead of copying into freshly allocated ones
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+        if self.model_name in whisper._ALIGNMENT_HEADS:
+            model.set_alignment_heads(whisper._ALIGNMENT_HEADS[self.model_name])
+        # Inference only: autograd must never write into the shared pages
+        return model.requires_grad_(False).eval()
+
+    def _mapped_checkpoint(self):
+        """Path of the float32 copy of the checkpoint, writing it on first use"""
+        import torch
+        import whisper
+
+        if os.path.isfile(self.model_name):
+            path = os.path.splitext(self.model_name)[0] + '.fp32.pt'
+        else:
+            cache = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+            path = os.path.join(cache, 'whisper', f"{self.model_name}.fp32.pt")
+        if os.path.exists(path):
+            return path
+
+        model = whisper.load_model(self.model_name, device='cpu')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        torch.save({'dims': vars(model.dims), 'model_state_dict': model.state_dict()}, tmp)
+        os.replace(tmp, path)  # workers converting at the same time just overwrite each other atomically
+        logger.info(f"Wrote float32 Whisper checkpoint for memory mapping: {path}")
+        return path
+
+    def transcribe(self, filepath, duration=0, language=None, task='transcribe'):
+        """Transcribe a clip, encoding the audio only once.
+
+        The encoder output is used both for language detection (limited to
+        WHISPER_LANGUAGES) and for decoding. Pass ``language`` (e.g. the
+        session's remembered one) to skip detection; it is still checked
+        against the decode's average log-probability and detection runs on
+        the same features when that is too low.
+
+        Decoding is capped at a token budget derived from ``duration`` and
+        WHISPER_MAX_WORDS and stops early when the output starts looping.
+        Clips longer than one 30 s window get the windowed decode of
+        :meth:`transcribe_long`, joined into one text.
+
+        Returns a dict with ``text``, ``language``, ``language_probability``
+        (None if detection didn't run), ``avg_logprob``, ``decode_steps``
+        ``stopped_early`` (output was looping) and ``budget_exhausted``
+        (decoding hit the token budget, so the text may be cut off).
+        Raises admission.Overloaded when the queue is full or the wait
+        for a slot runs past WHISPER_MAX_QUEUE_WAIT.
+        """
+        import torch
+        import whisper
+
+        audio = whisper.load_audio(filepath)
+        if len(audio) > whisper.audio.N_SAMPLES:
+            return self._transcribe_windows(audio, language, task)
+
+        with self.admission.admit(duration=duration):
+            model = self.load()
+            start = time.perf_counter()
+            # No autograd graph: the encoder would otherwise keep every layer's activations
+            with torch.inference_mode():
+                fp16 = model.device.type == 'cuda'
+                mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+                features = model.embed_audio((mel.half() if fp16 else mel).unsqueeze(0))
+
+                sample_len = self.token_budget(model, min(duration, 30.0))
+
+                probability = None
+                if not model.is_multilingual:
+                    language = 'en'
+                elif language is None:
+                    language, probability = self.detect_language(model, features)
+                result, early_stop = self._decode(model, features, language, task, fp16, sample_len)
+                steps = early_stop.steps
+
+                if probability is None and model.is_multilingual and result.avg_logprob < self.min_avg_logprob:
+                    detected, probability = self.detect_language(model, features)
+                    if detected != language:
+                        logger.info(f"Language {language} fits poorly (avg_logprob {result.avg_logprob:.2f}), "
+                                    f"re-decoding as {detected}")
+                        language = detected
+                        result, early_stop = self._decode(model, features, language, task, fp16, sample_len)
+                        steps += early_stop.steps
+
+            observe_whisper(self.model_name, duration, time.perf_counter() - start)
+
+        if early_stop.stopped:
+            logger.warning(f"Decoding of {filepath} stopped early: output was repeating")
+        if early_stop.truncated:
+            logger.warning(f"Decoding of {filepath} used up its token budget ({sample_len}); text may be cut off")
+        return {
+            "text": result.text,
+            "language": language,
+            "language_probability": probability,
+            "avg_logprob": result.avg_logprob,
+            "decode_steps": steps,
+            "stopped_early": bool(early_stop.stopped),
+            "budget_exhausted": bool(early_stop.truncated),
+        }
+
+    def token_budget(self, model, duration):
+        import decode_budget
+
+        return decode_budget.token_budget(duration, model.dims.n_text_ctx, self.max_words, self.words_per_second)
+
+    @staticmethod
+    def language_code(language):
+        """Kode bahasa Whisper untuk kode atau nama bahasa (mis. 'id', 'Indonesian'); None bila tidak dikenal"""
+        from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+        language = language.strip().lower()
+        if language in LANGUAGES:
+            return language
+        return TO_LANGUAGE_CODE.get(language)
+
+    def detect_language(self, model, features):
+        """Pilih bahasa dari WHISPER_LANGUAGES; probabilitas dinormalisasi di antara bahasa itu"""
+        _, probs = model.detect_language(features)
+        probs = probs[0] if isinstance(probs, list) else probs
+        allowed = {lang: probs.get(lang, 0.0) for lang in self.languages}
+        total = sum(allowed.values()) or 1.0
+        language = max(allowed, key=allowed.get)
+        return language, allowed[language] / total
+
+    def _decode(self, model, features, language, task, fp16, sample_len):
+        import whisper
+
+        import decode_budget
+
+        options = whisper.DecodingOptions(language=language, task=task, without_timestamps=True, fp16=fp16,
+                                          sample_len=sample_len)
+        results, early_stop = decode_budget.decode(model, features, options, self.compression_threshold)
+        return results[0], early_stop
+
+    def transcribe_batch(self, filepaths, language=None, task='transcribe'):
+        """Transcribe several clips with one encoder pass and one decode per language.
+
+        Meant for offline work (see bulk_transcribe.py), so it doesn't go
+        through admission control. Clips longer than 30 s are handed to
+        :meth:`transcribe`. Returns one dict per file, in order, with
+        ``text``, ``language``, ``duration`` and ``decode_steps``.
+        """
+        import torch
+        import whisper
+
+        import decode_budget
+
+        model = self.load()
+        fp16 = model.device.type == 'cuda'
+        audios = [whisper.load_audio(path) for path in filepaths]
+        durations = [len(audio) / whisper.audio.SAMPLE_RATE for audio in audios]
+        results = [None] * len(filepaths)
+
+        short = [i for i, audio in enumerate(audios) if len(audio) <= whisper.audio.N_SAMPLES]
+        for i in set(range(len(filepaths))) - set(short):
+            result = self.transcribe(filepaths[i], duration=durations[i], language=language, task=task)
+            results[i] = {"text": result['text'].strip(), "language": result['language'],
+                          "duration": durations[i], "decode_steps": result['decode_steps']}
+        if not short:
+            return results
+
+        start = time.perf_counter()
+        with torch.inference_mode():
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audios[i]), n_mels=model.dims.n_mels) for i in short
+            ]).to(model.device)
+            features = model.embed_audio(mel.half() if fp16 else mel)
+
+            if not model.is_multilingual:
+                languages = ['en'] * len(short)
+            elif language:
+                languages = [language] * len(short)
+            else:
+                languages = [self.detect_language(model, features[row:row + 1])[0] for row in range(len(short))]
+
+            # A DecodingTask takes a single language, so decode one group per language
+            for lang in set(languages):
+                rows = [row for row, row_lang in enumerate(languages) if row_lang == lang]
+                options = whisper.DecodingOptions(
+                    language=lang, task=task, without_timestamps=True, fp16=fp16,
+                    sample_len=self.token_budget(model, max(durations[short[row]] for row in rows)))
+                decoded, early_stop = decode_budget.decode(model, features[rows], options, self.compression_threshold)
+                for row, result in zip(rows, decoded):
+                    results[short[row]] = {"text": result.text.strip(), "language": lang,
+                                           "duration": durations[short[row]], "decode_steps": early_stop.steps}
+        observe_whisper(self.model_name, sum(durations[i] for i in short), time.perf_counter() - start)
+        return results
+
+    def transcribe_long(self, filepath, language=None, batch_size=8, task='transcribe'):
+        """Yield timestamped segments of a recording of any length, in order.
+
+        The recording is cut at pauses into windows of at most 30 s and
+        the windows are decoded ``batch_size`` at a time in a single
+        batched ``whisper.decode`` call. Each batch is admitted separately,
+        so short clips can still get in between the batches of a long one.
+        """
+        import whisper
+
+        yield from self._decode_windows(whisper.load_audio(filepath), language, batch_size, task)
+
+    def _transcribe_windows(self, audio, language, task):
+        """transcribe() untuk klip lebih dari 30 detik: decode per jendela, digabung jadi satu teks"""
+        stats = {}
+        segments = list(self._decode_windows(audio, language, self.batch_size, task, stats))
+        logprobs = stats.get('avg_logprobs')
+        if stats.get('stopped_early'):
+            logger.warning("Windowed decoding stopped early in at least one window: output was repeating")
+        if stats.get('budget_exhausted'):
+            logger.warning("Windowed decoding used up the token budget in at least one window; text may be cut off")
+        return {
+            "text": " ".join(segment['text'] for segment in segments),
+            "language": stats.get('language', language),
+            "language_probability": stats.get('language_probability'),
+            "avg_logprob": sum(logprobs) / len(logprobs) if logprobs else None,
+            "decode_steps": stats.get('decode_steps', 0),
+            "stopped_early": stats.get('stopped_early', False),
+            "budget_exhausted": stats.get('budget_exhausted', False),
+        }
+
+    def _decode_windows(self, audio, language, batch_size, task, stats=None):
+        """Segments of ``audio`` window by window; ``stats`` (a dict) collects language and decode counters"""
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+
+        import decode_budget
+        import longform
+
+        model = self.load()
+        fp16 = model.device.type == 'cuda'
+        windows = [w for w in longform.split_at_silence(audio) if not longform.is_silent(audio[w[0]:w[1]])]
+        if not model.is_multilingual:
+            language = 'en'
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, task=task)
+
+        for batch in longform.batches(windows, batch_size):
+            audio_seconds = sum(end - start for start, end in batch) / longform.SAMPLE_RATE
+            with self.admission.admit(duration=audio_seconds), torch.inference_mode():
+                start_time = time.perf_counter()
+                mel = torch.stack([
+                    whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[start:end]), n_mels=model.dims.n_mels)
+                    for start, end in batch
+                ]).to(model.device)
+                features = model.embed_audio(mel.half() if fp16 else mel)
+                if language is None:
+                    # One language for the whole recording, detected on the first window
+                    language, probability = self.detect_language(model, features[:1])
+                    if stats is not None:
+                        stats['language_probability'] = probability
+                # Budget for the longest window in the batch, plus room for timestamp tokens
+                longest = max(end - start for start, end in batch) / longform.SAMPLE_RATE
+                options = whisper.DecodingOptions(language=language, task=task,
+                                                  without_timestamps=False, fp16=fp16,
+                                                  sample_len=self.token_budget(model, longest * 1.5))
+                results, early_stop = decode_budget.decode(model, features, options, self.compression_threshold)
+                observe_whisper(self.model_name, audio_seconds, time.perf_counter() - start_time)
+            if stats is not None:
+                stats['language'] = language
+                stats['decode_steps'] = stats.get('decode_steps', 0) + early_stop.steps
+                stats['stopped_early'] = stats.get('stopped_early', False) or bool(early_stop.stopped)
+                stats['budget_exhausted'] = stats.get('budget_exhausted', False) or bool(early_stop.truncated)
+                stats.setdefault('avg_logprobs', []).extend(result.avg_logprob for result in results)
+            for (start, end), result in zip(batch, results):
+                yield from longform.parse_segments(result.tokens, tokenizer, start / longform.SAMPLE_RATE,
+                                                   (end - start) / longform.SAMPLE_RATE)
@@ -0,0 +1,84 @@
+"""Long-form transcription helpers.
+
+Whisper sees at most 30 s at a time. Longer recordings are cut into
+windows of at most 30 s, at the quietest point near the end of each
+window so words aren't split, and the windows are decoded as one batch
+instead of one after another. Timestamps from each window are shifted by
+the window's offset, giving segments on the recording's own timeline.
+"""
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME = 320  # 20 ms
+WINDOW_SECONDS = 30.0
+MIN_WINDOW_SECONDS = 20.0  # don't cut earlier than this when looking for a pause
+SMOOTHING_FRAMES = 10  # 200 ms, so a single quiet frame inside a word isn't taken for a pause
+SILENT_RMS = 1e-3  # about -60 dBFS
+
+
+def frame_energy_db(audio):
+    """Energi per frame 20 ms dalam dB, dihaluskan"""
+    frames = len(audio) // FRAME
+    power = np.square(audio[:frames * FRAME].reshape(frames, FRAME)).mean(axis=1)
+    energy = 10 * np.log10(power + 1e-10)
+    kernel = np.ones(SMOOTHING_FRAMES) / SMOOTHING_FRAMES
+    return np.convolve(energy, kernel, mode='same')
+
+
+def split_at_silence(audio, max_window=WINDOW_SECONDS, min_window=MIN_WINDOW_SECONDS):
+    """Return [(start_sample, end_sample)] windows of at most ``max_window`` seconds"""
+    total = len(audio)
+    max_len = int(max_window * SAMPLE_RATE)
+    if total <= max_len:
+        return [(0, total)]
+
+    energy = frame_energy_db(audio)
+    windows = []
+    start = 0
+    while total - start > max_len:
+        lo = (start + int(min_window * SAMPLE_RATE)) // FRAME
+        hi = (start + max_len) // FRAME
+        cut = (lo + int(np.argmin(energy[lo:hi]))) * FRAME
+        windows.append((start, cut))
+        start = cut
+    windows.append((start, total))
+    return windows
+
+
+def is_silent(chunk):
+    """Jendela tanpa suara dilewati; Whisper cenderung berhalusinasi di sana"""
+    return len(chunk) == 0 or float(np.sqrt(np.mean(np.square(chunk)))) < SILENT_RMS
+
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_segments(tokens, tokenizer, offset, window_seconds):
+    """Split one window's timestamped tokens into segments on the recording's timeline"""
+    segments = []
+    text_tokens = []
+    seg_start = 0.0
+
+    def flush(end):
+        text = tokenizer.decode(text_tokens).strip()
+        if text:
+            segments.append({
+                "start": round(offset + seg_start, 2),
+                "end": round(offset + min(end, window_seconds), 2),
+                "text": text,
+            })
+        text_tokens.clear()
+
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            timestamp = (token - tokenizer.timestamp_begin) * 0.02
+            if text_tokens:
+                flush(timestamp)
+            seg_start = timestamp
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        flush(window_seconds)
+    return segments
@@ -0,0 +1,139 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+from metrics import CACHE_REQUESTS
+
+CHUNK_SIZE = 64 * 1024
+
+# sha256 of legacy (non content-addressed) files keyed by (path, mtime, size)
+_etag_cache = OrderedDict()
+_etag_cache_lock = threading.Lock()
+ETAG_CACHE_SIZE = 4096
+
+
+def file_etag(path, stat):
+    """ETag kuat dari hash isi file, di-cache selama file tidak berubah"""
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _etag_cache_lock:
+        etag = _etag_cache.get(key)
+        if etag is not None:
+            _etag_cache.move_to_end(key)
+    if etag is not None:
+        CACHE_REQUESTS.inc(cache='audio_etag', result='hit')
+        return etag
+    CACHE_REQUESTS.inc(cache='audio_etag', result='miss')
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+
+    with _etag_cache_lock:
+        _etag_cache[key] = etag
+        if len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _file_body(f, length):
+    """Body that lets the server use sendfile() when it knows how.
+
+    Gunicorn sends ``wsgi.file_wrapper`` bodies with os.sendfile() starting
+    at the current file offset and stops at Content-Length, so ranges stay
+    zero-copy there. Other servers read file wrappers to EOF, so they get a
+    length-limited generator instead.
+    """
+    environ = request.environ
+    wrapper = environ.get('wsgi.file_wrapper')
+    if wrapper and environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        return wrapper(f, CHUNK_SIZE)
+    return _read_range(f, length)
+
+
+def send_media(path, mimetype=None, etag=None, max_age=31536000, immutable=True,
+               offload=None, offload_uri=None):
+    """Kirim file media dengan Range, ETag, 304 dan sendfile.
+
+    ``max_age=None`` sends ``no-cache``: caches keep the file but check the
+    ETag on every use, for files whose bytes may still change.
+    ``offload`` can be ``'x-accel-redirect'`` (nginx, needs ``offload_uri``)
+    or ``'x-sendfile'`` (Apache/lighttpd) to hand the byte transfer to the
+    front proxy; validators and cache headers are still set here.
+    """
+    stat = os.stat(path)
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if etag is None:
+        etag = file_etag(path, stat)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': http_date(stat.st_mtime),
+    }
+
+    def finish(response):
+        response.set_etag(etag)
+        response.cache_control.public = True
+        if max_age is None:
+            response.cache_control.no_cache = True
+            return response
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = immutable
+        return response
+
+    if request.if_none_match.contains(etag):
+        return finish(Response(status=304, headers=headers))
+
+    if offload == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = offload_uri
+        return finish(Response(status=200, headers=headers, mimetype=mimetype))
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return finish(Response(status=200, headers=headers, mimetype=mimetype))
+
+    size = stat.st_size
+    start, stop, status = 0, size, 200
+    rng = request.range
+    if rng is not None and ('If-Range' not in request.headers or request.if_range.etag == etag):
+        bounds = rng.range_for_length(size)
+        if bounds is not None:
+            start, stop = bounds
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+        elif len(rng.ranges) == 1:
+            headers['Content-Range'] = f"bytes */{size}"
+            return finish(Response(status=416, headers=headers))
+        # Multiple ranges: ignore the header and send the whole file
+
+    f = open(path, 'rb')
+    if start:
+        f.seek(start)
+    length = stop - start
+    headers['Content-Length'] = str(length)
+
+    if request.method == 'HEAD':
+        f.close()
+        return finish(Response(status=status, headers=headers, mimetype=mimetype))
+
+    response = Response(_file_body(f, length), status=status, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+    return finish(response)
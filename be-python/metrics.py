@@ -0,0 +1,217 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, jsonify, request
+
+from profiling import is_admin
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += state[len(self.buckets)]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint',
+    ('endpoint', 'method', 'status')))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'stage_duration_seconds', 'Latency of individual processing stages',
+    ('endpoint', 'stage')))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'upstream_errors_total', 'Failed calls to upstream services',
+    ('upstream', 'reason')))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'cache_requests_total', 'Cache lookups by cache and result',
+    ('cache', 'result')))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'app_startup_seconds', 'Time spent in create_app()'))
+WHISPER_AUDIO_SECONDS = REGISTRY.register(Counter(
+    'whisper_audio_seconds_total', 'Seconds of audio transcribed', ('model',)))
+WHISPER_WALL_SECONDS = REGISTRY.register(Counter(
+    'whisper_wall_seconds_total', 'Wall-clock seconds spent in Whisper', ('model',)))
+WHISPER_SPEED = REGISTRY.register(Histogram(
+    'whisper_realtime_factor', 'Audio seconds transcribed per wall-clock second', ('model',),
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)))
+
+
+def stage(name, endpoint=None):
+    """Ukur durasi satu tahap dalam request yang sedang berjalan"""
+    if endpoint is None:
+        endpoint = request.endpoint if has_request_context() else ''
+    return STAGE_LATENCY.time(endpoint=endpoint or '', stage=name)
+
+
+def timed(stage_name):
+    """Decorator version of :func:`stage`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_whisper(model_name, audio_seconds, wall_seconds):
+    WHISPER_AUDIO_SECONDS.inc(audio_seconds, model=model_name)
+    WHISPER_WALL_SECONDS.inc(wall_seconds, model=model_name)
+    if wall_seconds > 0:
+        WHISPER_SPEED.observe(audio_seconds / wall_seconds, model=model_name)
+
+
+def init_app(app):
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None and request.endpoint != 'metrics':
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                endpoint=request.endpoint or 'unknown',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        # Per-endpoint traffic is not public: scrapers on METRICS_ALLOWED_IPS, or X-Admin-Token.
+        # Values are this worker process's only; see METRICS_ALLOWED_IPS in config.py
+        if request.remote_addr not in current_app.config['METRICS_ALLOWED_IPS'] and not is_admin():
+            return jsonify({"error": "Not found"}), 404
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
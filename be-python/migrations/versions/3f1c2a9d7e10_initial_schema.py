@@ -0,0 +1,128 @@
+"""initial schema
+
+Revision ID: 3f1c2a9d7e10
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7e10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sessions',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('messages',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('session_id', sa.String(length=36), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('timestamp', sa.BigInteger(), nullable=False),
+    sa.Column('image_path', sa.String(length=255), nullable=True),
+    sa.Column('audio_path', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['sessions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('session_languages',
+    sa.Column('session_id', sa.String(length=36), nullable=False),
+    sa.Column('language', sa.String(length=8), nullable=False),
+    sa.Column('probability', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['sessions.id'], ),
+    sa.PrimaryKeyConstraint('session_id')
+    )
+    op.create_table('session_summaries',
+    sa.Column('session_id', sa.String(length=36), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('last_message', sa.String(length=120), nullable=True),
+    sa.Column('last_role', sa.String(length=20), nullable=True),
+    sa.Column('last_message_at', sa.BigInteger(), nullable=True),
+    sa.Column('has_audio', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['sessions.id'], ),
+    sa.PrimaryKeyConstraint('session_id')
+    )
+    op.create_table('archived_sessions',
+    sa.Column('session_id', sa.String(length=36), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.BigInteger(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('byte_offset', sa.BigInteger(), nullable=False),
+    sa.Column('byte_length', sa.BigInteger(), nullable=False),
+    sa.Column('audio_paths', sa.Text(), nullable=True),
+    sa.Column('archived_at', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('session_id')
+    )
+    with op.batch_alter_table('archived_sessions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_archived_sessions_archived_at'), ['archived_at'], unique=False)
+
+    op.create_table('idempotency_keys',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('endpoint', sa.String(length=64), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('response_code', sa.Integer(), nullable=True),
+    sa.Column('response_body', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_idempotency_keys_created_at'), ['created_at'], unique=False)
+
+    op.create_table('changes',
+    sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.String(length=36), nullable=False),
+    sa.Column('session_id', sa.String(length=36), nullable=True),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('timestamp', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('seq'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('changes', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_changes_session_id'), ['session_id'], unique=False)
+
+    op.create_table('audio_blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('codec', sa.String(length=16), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('original_size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.BigInteger(), nullable=False),
+    sa.Column('last_released_at', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+
+
+def downgrade():
+    op.drop_table('audio_blobs')
+    with op.batch_alter_table('changes', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_changes_session_id'))
+
+    op.drop_table('changes')
+    with op.batch_alter_table('idempotency_keys', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_idempotency_keys_created_at'))
+
+    op.drop_table('idempotency_keys')
+    with op.batch_alter_table('archived_sessions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_archived_sessions_archived_at'))
+
+    op.drop_table('archived_sessions')
+    op.drop_table('session_summaries')
+    op.drop_table('session_languages')
+    op.drop_table('messages')
+    op.drop_table('sessions')
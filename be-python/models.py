@@ -0,0 +1,286 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, insert, literal, select, text
+from sqlalchemy.orm import Session as OrmSession
+
+db = SQLAlchemy()
+
+SNIPPET_LENGTH = 120
+SESSION_NAME_LENGTH = 100
+CHANGE_FEED_LOCK = 0x50544E4B  # PostgreSQL advisory lock key, see lock_change_feed()
+CHANGES_PRUNE_INTERVAL = 3600  # seconds between prunes of the change feed, per process
+_last_prune = {'at': None}
+
+# Database Models
+class Session(db.Model):
+    __tablename__ = 'sessions'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(SESSION_NAME_LENGTH), nullable=False)
+    created_at = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.BigInteger, nullable=False, index=True)  # session list order
+    
+    messages = db.relationship('Message', backref='session', lazy=True, cascade='all, delete-orphan')
+    language = db.relationship('SessionLanguage', uselist=False, lazy=True, cascade='all, delete-orphan')
+    # Joined so the session list (and the change feed) get it in the same query
+    summary = db.relationship('SessionSummary', uselist=False, lazy='joined', cascade='all, delete-orphan')
+
+class Message(db.Model):
+    __tablename__ = 'messages'
+    # Per-session reads, counts and deletes, in timestamp order
+    __table_args__ = (db.Index('ix_messages_session_ts', 'session_id', 'timestamp'),)
+    
+    id = db.Column(db.String(36), primary_key=True)
+    session_id = db.Column(db.String(36), db.ForeignKey('sessions.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    timestamp = db.Column(db.BigInteger, nullable=False)
+    image_path = db.Column(db.String(255))
+    audio_path = db.Column(db.String(255))
+
+class SessionLanguage(db.Model):
+    """Bahasa hasil deteksi Whisper yang diingat per sesi"""
+    __tablename__ = 'session_languages'
+
+    session_id = db.Column(db.String(36), db.ForeignKey('sessions.id'), primary_key=True)
+    language = db.Column(db.String(8), nullable=False)
+    probability = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.BigInteger, nullable=False)
+
+class SessionSummary(db.Model):
+    """Ringkasan sesi untuk daftar sesi, diperbarui dalam transaksi yang sama dengan pesannya"""
+    __tablename__ = 'session_summaries'
+
+    session_id = db.Column(db.String(36), db.ForeignKey('sessions.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message = db.Column(db.String(SNIPPET_LENGTH))  # whitespace-collapsed snippet
+    last_role = db.Column(db.String(20))
+    last_message_at = db.Column(db.BigInteger)
+    has_audio = db.Column(db.Boolean, nullable=False, default=False)
+
+class ArchivedSession(db.Model):
+    """Sesi yang dipindah ke arsip dingin; menunjuk ke rekamannya di file arsip"""
+    __tablename__ = 'archived_sessions'
+
+    session_id = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(SESSION_NAME_LENGTH), nullable=False)
+    created_at = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.BigInteger, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # relative to ARCHIVE_FOLDER
+    byte_offset = db.Column(db.BigInteger, nullable=False)
+    byte_length = db.Column(db.BigInteger, nullable=False)
+    audio_paths = db.Column(db.Text)  # JSON list; archived audio stays referenced for GC
+    archived_at = db.Column(db.BigInteger, nullable=False, index=True)
+
+class IdempotencyKey(db.Model):
+    """Respons tersimpan untuk header Idempotency-Key dari klien"""
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(255), primary_key=True)
+    endpoint = db.Column(db.String(64), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # same key with a different request is rejected
+    status = db.Column(db.String(10), nullable=False)  # 'pending' | 'done'
+    response_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.BigInteger, nullable=False, index=True)
+
+class Change(db.Model):
+    __tablename__ = 'changes'
+    __table_args__ = {'sqlite_autoincrement': True}  # never reuse seq values
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'session' | 'message'
+    entity_id = db.Column(db.String(36), nullable=False)
+    session_id = db.Column(db.String(36), index=True)
+    op = db.Column(db.String(10), nullable=False)  # 'insert' | 'update' | 'delete'
+    timestamp = db.Column(db.BigInteger, nullable=False)
+
+class AudioBlob(db.Model):
+    __tablename__ = 'audio_blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)  # relative to the audio store root
+    codec = db.Column(db.String(16), nullable=False)  # 'wav' as uploaded, 'opus' once re-encoded
+    size = db.Column(db.BigInteger, nullable=False)
+    original_size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.BigInteger, nullable=False)
+    last_released_at = db.Column(db.BigInteger)
+
+def serialize_session(session):
+    summary = session.summary
+    return {
+        "id": session.id,
+        "name": session.name,
+        "created_at": session.created_at,
+        "updated_at": session.updated_at,
+        "message_count": summary.message_count if summary else 0,
+        "last_message": summary.last_message if summary else None,
+        "last_role": summary.last_role if summary else None,
+        "has_audio": bool(summary and summary.has_audio)
+    }
+
+def serialize_message(msg):
+    return {
+        "id": msg.id,
+        "session_id": msg.session_id,
+        "content": msg.content,
+        "role": msg.role,
+        "timestamp": msg.timestamp,
+        "image_path": msg.image_path,
+        "audio_path": msg.audio_path
+    }
+
+def snippet(content):
+    text = " ".join((content or "").split())
+    return text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH - 1] + "\u2026"
+
+def summarize_added(session, messages):
+    """Tambahkan pesan baru (urut waktu) ke ringkasan sesi, tanpa commit"""
+    summary = session.summary
+    if summary is None:
+        # Sessions from before summaries existed; autoflush puts the new messages in the count
+        refresh_summary(session)
+        return
+    summary.message_count = SessionSummary.message_count + len(messages)  # atomic in SQL
+    last = messages[-1]
+    if summary.last_message_at is None or last.timestamp >= summary.last_message_at:
+        summary.last_message = snippet(last.content)
+        summary.last_role = last.role
+        summary.last_message_at = last.timestamp
+    if any(m.audio_path for m in messages):
+        summary.has_audio = True
+
+def refresh_summary(session):
+    """Hitung ulang ringkasan dari tabel messages (setelah hapus/ubah), tanpa commit"""
+    count, audio_count = db.session.query(func.count(Message.id), func.count(Message.audio_path)) \
+        .filter(Message.session_id == session.id).one()
+    last = db.session.query(Message.content, Message.role, Message.timestamp) \
+        .filter(Message.session_id == session.id) \
+        .order_by(Message.timestamp.desc()).first()
+    if session.summary is None:
+        session.summary = SessionSummary(session_id=session.id)
+    summary = session.summary
+    summary.message_count = count
+    summary.has_audio = audio_count > 0
+    summary.last_message = snippet(last.content) if last else None
+    summary.last_role = last.role if last else None
+    summary.last_message_at = last.timestamp if last else None
+
+# Long-poll waiters on /api/changes are woken up after every commit that
+# recorded a change in this process.
+CHANGE_CONDITION = threading.Condition()
+
+def lock_change_feed():
+    """Urutkan transaksi yang mencatat perubahan, sekali per transaksi.
+
+    Clients read the feed by ``seq > since``. On PostgreSQL two
+    transactions can take seq 7 and 8 and commit 8 first, and a client
+    that has already seen 8 never gets 7. Holding one transaction-scoped
+    advisory lock from the first change until commit makes seq order
+    commit order. SQLite already allows only one writer at a time.
+    """
+    if db.session.info.get('change_feed_locked'):
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_FEED_LOCK})
+    db.session.info['change_feed_locked'] = True
+    _maybe_prune_changes()
+
+def _maybe_prune_changes():
+    """Prune the feed from a writing transaction, at most once per CHANGES_PRUNE_INTERVAL"""
+    days = current_app.config['CHANGES_RETENTION_DAYS']
+    now = time.monotonic()
+    if days <= 0 or (_last_prune['at'] is not None and now - _last_prune['at'] < CHANGES_PRUNE_INTERVAL):
+        return
+    _last_prune['at'] = now
+    prune_changes(int((datetime.now().timestamp() - days * 86400) * 1000))
+
+def prune_changes(cutoff):
+    """Hapus change lebih lama dari ``cutoff`` (epoch ms), tanpa commit.
+
+    The newest row always stays, so the smallest seq left tells readers
+    how far back the feed still reaches (see change_seq_range()).
+    """
+    newest = db.session.query(func.max(Change.seq)).scalar()
+    if newest is None:
+        return 0
+    return Change.query.filter(Change.timestamp < cutoff, Change.seq < newest) \
+        .delete(synchronize_session=False)
+
+def change_seq_range():
+    """(oldest, newest) seq still in the feed, (None, None) while it is empty"""
+    return db.session.query(func.min(Change.seq), func.max(Change.seq)).one()
+
+def record_change(entity, entity_id, op, session_id=None):
+    """Catat perubahan ke change feed dalam transaksi yang sedang berjalan"""
+    lock_change_feed()
+    db.session.add(Change(
+        entity=entity,
+        entity_id=entity_id,
+        session_id=session_id,
+        op=op,
+        timestamp=int(datetime.now().timestamp() * 1000)
+    ))
+    db.session.info['changes_pending'] = True
+
+def record_message_changes(session_id, op):
+    """Catat ``op`` untuk semua pesan sesi dengan satu INSERT ... SELECT, tanpa commit"""
+    lock_change_feed()
+    timestamp = int(datetime.now().timestamp() * 1000)
+    db.session.execute(insert(Change).from_select(
+        ['entity', 'entity_id', 'session_id', 'op', 'timestamp'],
+        select(literal('message'), Message.id, Message.session_id, literal(op), literal(timestamp))
+        .where(Message.session_id == session_id)
+    ))
+    db.session.info['changes_pending'] = True
+
+def delete_session_rows(session_id):
+    """Hapus sesi beserta pesan dan data turunannya secara set-based, tanpa commit.
+
+    Unlike ``db.session.delete(session)`` with the ORM cascade this never
+    loads the session's messages. Audio references have to be released
+    (or kept, when archiving) by the caller first.
+    """
+    record_message_changes(session_id, 'delete')
+    record_change('session', session_id, 'delete', session_id)
+    for model in (Message, SessionLanguage, SessionSummary):
+        model.query.filter_by(session_id=session_id).delete(synchronize_session=False)
+    Session.query.filter_by(id=session_id).delete(synchronize_session=False)
+
+@event.listens_for(OrmSession, 'after_commit')
+def _notify_change_waiters(session):
+    session.info.pop('change_feed_locked', None)
+    if session.info.pop('changes_pending', False):
+        with CHANGE_CONDITION:
+            CHANGE_CONDITION.notify_all()
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _discard_pending_changes(session):
+    session.info.pop('changes_pending', None)
+    session.info.pop('change_feed_locked', None)
+
+def create_missing_indexes():
+    """Buat indeks yang belum ada; create_all() only indexes the tables it creates itself"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def configure_engine(engine, config):
+    """Pragma SQLite untuk setiap koneksi baru (WAL, synchronous=NORMAL); no-op for other databases"""
+    if engine.dialect.name != 'sqlite' or not config['SQLITE_WAL']:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes; fsync at checkpoints
+        finally:
+            cursor.close()
@@ -0,0 +1,289 @@
+"""Opt-in per-request profiling.
+
+A request is profiled when it carries ``X-Profile: cprofile|sample|tracemalloc``
+together with a valid ``X-Admin-Token``, or when it falls into the sampled
+share of traffic set with PROFILE_SAMPLE_RATE (or at runtime through
+``POST /admin/profiling``). Results are written to PROFILE_DIR:
+
+- ``cprofile``: a pstats ``.prof`` file (snakeviz, ``python -m pstats``)
+  and a ``.txt`` summary sorted by cumulative time;
+- ``sample``: a wall-clock stack sampler on the request thread, written
+  as collapsed stacks (``.folded``) for flamegraph.pl or speedscope;
+- ``tracemalloc``: the allocation diff between request start and end (``.txt``).
+
+``POST /admin/tracemalloc/snapshot`` diffs whole-process memory against
+the previous snapshot, to follow growth across model loads and uploads.
+Tracing it turns on stays on; tracing started for profiled requests is
+stopped again once the last of them finishes.
+Only the Flask routes are covered; in ASGI mode that excludes the async
+chat/weather/transcribe handlers.
+"""
+import cProfile
+import functools
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, jsonify, request, send_file
+
+MODES = ('cprofile', 'sample', 'tracemalloc')
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.(prof|folded|txt)$')
+TRACEMALLOC_FRAMES = 25
+TRACEMALLOC_TOP = 40
+
+admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+# Runtime settings, per process; start from config in init_app
+_settings = {'mode': 'sample', 'rate': 0.0}
+_last_snapshot = None
+_snapshot_lock = threading.Lock()
+# Requests currently profiled with tracemalloc, and whether they (not the admin snapshot) started tracing
+_tracing = {'requests': 0, 'owned': False}
+_tracing_lock = threading.Lock()
+
+
+def admin_required(view):
+    """Endpoint admin: butuh X-Admin-Token yang cocok dengan ADMIN_TOKEN (nonaktif jika kosong)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({"error": "Not found"}), 404
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def is_admin():
+    token = current_app.config.get('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+class StackSampler(threading.Thread):
+    """Sample one thread's stack every ``interval`` seconds into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _choose_mode():
+    requested = request.headers.get('X-Profile')
+    if requested:
+        return requested if requested in MODES and is_admin() else None
+    if _settings['rate'] and random.random() < _settings['rate']:
+        return _settings['mode']
+    return None
+
+
+def _start():
+    if request.blueprint == 'admin' or request.endpoint == 'metrics':
+        return
+    mode = _choose_mode()
+    if mode is None:
+        return
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # another profiler is already active (Python 3.12+ allows only one)
+    elif mode == 'sample':
+        profiler = StackSampler(threading.get_ident(), current_app.config['PROFILE_SAMPLE_INTERVAL'])
+        profiler.start()
+    else:
+        _begin_tracing()
+        profiler = tracemalloc.take_snapshot()
+    g._profile = (mode, profiler, time.perf_counter())
+
+
+def _finish(response=None):
+    state = g.pop('_profile', None)
+    if state is None:
+        return response
+    mode, profiler, started = state
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    name = (f"{datetime.now():%Y%m%d-%H%M%S-%f}-{request.endpoint or 'unknown'}-{mode}-{elapsed_ms:.0f}ms"
+            .replace('/', '_'))
+    folder = current_app.config['PROFILE_DIR']
+    os.makedirs(folder, exist_ok=True)
+
+    if mode == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(os.path.join(folder, f"{name}.prof"))
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(60)
+        _write(folder, f"{name}.txt", summary.getvalue())
+        filename = f"{name}.prof"
+    elif mode == 'sample':
+        profiler.stop()
+        filename = _write(folder, f"{name}.folded", profiler.folded())
+    else:
+        try:
+            diff = tracemalloc.take_snapshot().compare_to(profiler, 'traceback')
+        finally:
+            _end_tracing()
+        filename = _write(folder, f"{name}.txt", _format_diff(diff))
+
+    _prune(folder, current_app.config['PROFILE_MAX_FILES'])
+    if response is not None:
+        response.headers['X-Profile-Id'] = filename
+    return response
+
+
+def _begin_tracing():
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracing['owned'] = True
+        _tracing['requests'] += 1
+
+
+def _end_tracing():
+    """Hentikan tracemalloc setelah request terakhir yang memulainya, agar proses tidak terus membayar tracing"""
+    with _tracing_lock:
+        _tracing['requests'] -= 1
+        if _tracing['requests'] == 0 and _tracing['owned']:
+            tracemalloc.stop()
+            _tracing['owned'] = False
+
+
+def _write(folder, filename, text):
+    with open(os.path.join(folder, filename), 'w', encoding='utf-8') as f:
+        f.write(text)
+    return filename
+
+
+def _format_diff(diff):
+    lines = []
+    for stat in diff[:TRACEMALLOC_TOP]:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), now {stat.size / 1024:.1f} KiB")
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+    return '\n'.join(lines) + '\n'
+
+
+def _prune(folder, keep):
+    entries = sorted((e for e in os.scandir(folder) if PROFILE_NAME_RE.match(e.name)),
+                     key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def init_app(app):
+    _settings['mode'] = app.config['PROFILE_MODE']
+    _settings['rate'] = app.config['PROFILE_SAMPLE_RATE']
+    app.before_request(_start)
+    app.after_request(_finish)
+    # Requests that raised never reach after_request; still stop the profiler
+    app.teardown_request(lambda exc: _finish())
+    app.register_blueprint(admin)
+
+
+@admin.route('/profiling', methods=['GET', 'POST'])
+@admin_required
+def profiling_settings():
+    """Lihat/ubah mode dan persentase sampling (per proses worker)"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', _settings['mode'])
+        if mode not in MODES:
+            return jsonify({"error": f"mode must be one of {', '.join(MODES)}"}), 400
+        try:
+            rate = float(data.get('rate', _settings['rate']))
+        except (TypeError, ValueError):
+            return jsonify({"error": "rate must be a number between 0 and 1"}), 400
+        if not 0 <= rate <= 1:
+            return jsonify({"error": "rate must be a number between 0 and 1"}), 400
+        _settings.update(mode=mode, rate=rate)
+    return jsonify({**_settings, "pid": os.getpid(), "tracemalloc": tracemalloc.is_tracing()})
+
+
+@admin.route('/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    folder = current_app.config['PROFILE_DIR']
+    if not os.path.isdir(folder):
+        return jsonify([])
+    entries = sorted((e for e in os.scandir(folder) if PROFILE_NAME_RE.match(e.name)),
+                     key=lambda e: e.stat().st_mtime, reverse=True)
+    return jsonify([{
+        "name": entry.name,
+        "size": entry.stat().st_size,
+        "created_at": int(entry.stat().st_mtime * 1000),
+        "url": f"/admin/profiles/{entry.name}"
+    } for entry in entries])
+
+
+@admin.route('/profiles/<name>', methods=['GET'])
+@admin_required
+def get_profile(name):
+    path = os.path.join(os.path.abspath(current_app.config['PROFILE_DIR']), name)
+    if not PROFILE_NAME_RE.match(name) or not os.path.isfile(path):
+        return jsonify({"error": "Profile not found"}), 404
+    mimetype = 'application/octet-stream' if name.endswith('.prof') else 'text/plain; charset=utf-8'
+    return send_file(path, mimetype=mimetype, as_attachment=name.endswith('.prof'))
+
+
+@admin.route('/tracemalloc/snapshot', methods=['POST'])
+@admin_required
+def tracemalloc_snapshot():
+    """Ambil snapshot memori proses dan bandingkan dengan snapshot sebelumnya"""
+    global _last_snapshot
+    with _snapshot_lock:
+        with _tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                _last_snapshot = None
+            _tracing['owned'] = False  # asked for explicitly: stays on for the next snapshot
+        snapshot = tracemalloc.take_snapshot()
+        previous, _last_snapshot = _last_snapshot, snapshot
+
+    current, peak = tracemalloc.get_traced_memory()
+    result = {"pid": os.getpid(), "traced_kib": current // 1024, "peak_kib": peak // 1024}
+    if previous is None:
+        result["message"] = "Baseline snapshot taken; call again to see growth"
+        return jsonify(result)
+
+    folder = current_app.config['PROFILE_DIR']
+    os.makedirs(folder, exist_ok=True)
+    diff = snapshot.compare_to(previous, 'traceback')
+    result["file"] = _write(folder, f"{datetime.now():%Y%m%d-%H%M%S-%f}-process-tracemalloc.txt", _format_diff(diff))
+    result["top"] = [{
+        "size_diff_kib": round(stat.size_diff / 1024, 1),
+        "count_diff": stat.count_diff,
+        "where": str(stat.traceback[0]) if len(stat.traceback) else None
+    } for stat in diff[:10]]
+    _prune(folder, current_app.config['PROFILE_MAX_FILES'])
+    return jsonify(result)
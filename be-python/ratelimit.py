@@ -0,0 +1,233 @@
+"""Per-client token-bucket rate limiting.
+
+Every client (by address, or by session with RATELIMIT_KEY=session) has
+one bucket per class: ``cheap`` for /api/sessions/... and /api/weather,
+and ``expensive`` for chat and transcription, which spend DeepSeek quota
+and Whisper time. A bucket holds up to BURST tokens and refills at RATE
+tokens per second. Each request takes one token, and a request that
+finds the bucket empty gets 429 with Retry-After. Every limited response
+carries the draft-standard RateLimit-Limit / -Remaining / -Reset headers.
+
+A session id only gets its own bucket when that session exists; any
+other id falls back to the client address, so inventing ids doesn't buy
+fresh buckets. Keys are addresses, so behind a reverse proxy (or ngrok)
+set TRUSTED_PROXY_COUNT, or every client shares the proxy's bucket.
+
+Buckets live in process memory by default (O(1) per request, LRU-capped
+at RATELIMIT_MAX_KEYS). With several gunicorn workers or nodes each
+process then counts on its own, so set RATELIMIT_STORAGE_URL=redis://...
+to share them.
+
+Measure the overhead with ``python bench/ratelimit_overhead.py``.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+from metrics import REGISTRY, Counter
+from models import Session, db
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_REJECTED = REGISTRY.register(Counter(
+    'ratelimit_rejected_total', 'Requests rejected by the rate limiter', ('bucket',)))
+RATELIMIT_STORE_ERRORS = REGISTRY.register(Counter(
+    'ratelimit_store_errors_total', 'Rate limit checks let through because the store failed'))
+
+EXPENSIVE_ENDPOINTS = {'api.chat', 'api.transcribe_audio', 'api.transcribe_long'}
+CHEAP_PREFIXES = ('/api/sessions', '/api/weather')
+SESSION_HEADER = 'X-Session-Id'
+
+
+def bucket_for(endpoint, path):
+    """'cheap', 'expensive' or None (not limited: health check, /metrics, audio files, uploads)"""
+    if endpoint in EXPENSIVE_ENDPOINTS:
+        return 'expensive'
+    if path.startswith(CHEAP_PREFIXES):
+        return 'cheap'
+    return None
+
+
+class Decision:
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self, allowed, limit, tokens, rate):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = int(tokens)
+        self.reset = math.ceil((limit - tokens) / rate)  # seconds until the bucket is full again
+        self.retry_after = 0 if allowed else math.ceil((1 - tokens) / rate)
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+class MemoryStore:
+    """Bucket per key in a dict of the current process; the least recently used keys are dropped beyond max_keys"""
+
+    blocking = False
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Ambil satu token; returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                tokens = burst
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(burst, state[0] + (now - state[1]) * rate)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+        return allowed, tokens
+
+
+# KEYS[1] bucket; ARGV rate, burst. Uses the Redis clock so all nodes agree on the time.
+REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 's')
+local tokens = burst
+if state[1] then
+    tokens = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+end
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 's', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisStore:
+    """Bucket per key in Redis, updated atomically by a Lua script (needs the ``redis`` package)"""
+
+    blocking = True
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+        self._take = self.client.register_script(REDIS_TAKE)
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[rate, burst])
+        return bool(allowed), float(tokens)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = False
+        self.store = None
+        self.buckets = {}
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RATELIMIT_ENABLED']
+        self.key_by = config['RATELIMIT_KEY']
+        if self.key_by not in ('client', 'session'):
+            raise ValueError("RATELIMIT_KEY must be 'client' or 'session'")
+        self.buckets = {
+            'cheap': (config['RATELIMIT_CHEAP_RATE'], config['RATELIMIT_CHEAP_BURST']),
+            'expensive': (config['RATELIMIT_EXPENSIVE_RATE'], config['RATELIMIT_EXPENSIVE_BURST']),
+        }
+        if self.enabled and not config['TRUSTED_PROXY_COUNT']:
+            if config['USE_NGROK']:
+                raise ValueError("RATELIMIT_ENABLED behind ngrok needs TRUSTED_PROXY_COUNT=1, "
+                                 "otherwise every client shares one bucket")
+            logger.warning("Rate limiting by socket address with TRUSTED_PROXY_COUNT=0: "
+                           "clients behind one proxy or NAT share a bucket")
+        url = config['RATELIMIT_STORAGE_URL']
+        self.store = RedisStore(url) if url else MemoryStore(config['RATELIMIT_MAX_KEYS'])
+        app.extensions['rate_limiter'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def key(self, client, session_id=None):
+        if self.key_by == 'session' and session_id:
+            return f"s:{session_id}"
+        return f"c:{client}"
+
+    @staticmethod
+    def known_session(session_id):
+        """``session_id`` if that session exists, else None (the request is keyed by address)"""
+        if not session_id:
+            return None
+        exists = db.session.query(Session.id).filter_by(id=session_id).first() is not None
+        return session_id if exists else None
+
+    def check(self, bucket, key):
+        """Take a token from ``key``'s ``bucket``; a failing store lets the request through"""
+        rate, burst = self.buckets[bucket]
+        try:
+            allowed, tokens = self.store.take(f"{bucket}:{key}", rate, burst)
+        except Exception as e:
+            logger.warning(f"Rate limit store failed, request not limited: {e}")
+            RATELIMIT_STORE_ERRORS.inc()
+            return None
+        if not allowed:
+            RATELIMIT_REJECTED.inc(bucket=bucket)
+        return Decision(allowed, burst, tokens, rate)
+
+    def _session_id(self):
+        # Never from a multipart body: reading it would take in the whole upload before the check
+        session_id = (request.view_args or {}).get('session_id') or request.headers.get(SESSION_HEADER) \
+            or request.args.get('session_id')
+        if not session_id and request.is_json:
+            data = request.get_json(silent=True)
+            session_id = data.get('session_id') if isinstance(data, dict) else None
+        return session_id
+
+    def _before_request(self):
+        if not self.enabled or request.method == 'OPTIONS':
+            return None
+        bucket = bucket_for(request.endpoint, request.path)
+        if bucket is None:
+            return None
+        session_id = self.known_session(self._session_id()) if self.key_by == 'session' else None
+        decision = self.check(bucket, self.key(request.remote_addr, session_id))
+        if decision is None:
+            return None
+        g._ratelimit = decision
+        if not decision.allowed:
+            return too_many_requests(decision)
+        return None
+
+    def _after_request(self, response):
+        decision = g.pop('_ratelimit', None)
+        if decision is not None:
+            response.headers.update(decision.headers())
+        return response
+
+
+def too_many_requests(decision):
+    """429 dengan Retry-After saat bucket klien kosong"""
+    return jsonify({
+        "error": "Too many requests, please slow down",
+        "retry_after": decision.retry_after
+    }), 429, decision.headers()
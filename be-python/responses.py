@@ -0,0 +1,148 @@
+"""JSON encoding and response compression.
+
+- FastJSONProvider: ``jsonify`` and ``request.get_json`` go through
+  orjson when it is installed (same sorted keys, compact output, UTF-8
+  instead of ``\\uXXXX`` escapes), otherwise through Flask's stdlib
+  provider unchanged.
+- compress(): JSON/text responses of at least COMPRESS_MIN_SIZE bytes are
+  sent brotli- (if the ``brotli`` package is installed) or gzip-encoded,
+  whichever the client accepts. Streamed bodies are compressed chunk by
+  chunk with a sync flush, so NDJSON segments still arrive one by one.
+- stream_json_array(): a JSON array written row by row, for result sets
+  too large to build as one list.
+
+Measure with ``python bench/json_payloads.py``.
+"""
+import gzip
+import zlib
+
+from flask import current_app, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv')
+STREAM_BATCH = 100  # rows per chunk of a streamed array
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Provider JSON Flask dengan orjson bila tersedia"""
+
+    def _orjson_options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        return options | orjson.OPT_SORT_KEYS if self.sort_keys else options
+
+    def dumps(self, obj, **kwargs):
+        # orjson only writes compact output; anything else (indent, custom cls) goes the stdlib way
+        if orjson is None or set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)  # indented output
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def stream_json_array(rows, serialize):
+    """Response that writes ``[row, row, ...]`` in batches, holding one batch in memory at a time"""
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '['
+        batch, first = [], True
+        for row in rows:
+            batch.append(dumps(serialize(row), separators=(',', ':')))
+            if len(batch) >= STREAM_BATCH:
+                yield ('' if first else ',') + ','.join(batch)
+                batch, first = [], False
+        if batch:
+            yield ('' if first else ',') + ','.join(batch)
+        yield ']\n'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding):
+    """(compress, flush, finish) for a streamed body"""
+    config = current_app.config
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    compress, flush, finish = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Let the wrapped generator clean up (stream_with_context pops its context here)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress(response):
+    """after_request: kompres respons JSON/teks yang cukup besar sesuai Accept-Encoding"""
+    if (response.status_code not in (200, 201) or response.mimetype not in COMPRESSIBLE
+            or response.direct_passthrough or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    config = current_app.config
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'br':
+            body = brotli.compress(body, quality=config['COMPRESS_BROTLI_QUALITY'])
+        else:
+            body = gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'])
+        response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        # The encoded body is a different representation of the same resource
+        response.set_etag(f"{response.get_etag()[0]}-{encoding}", weak=True)
+    return response
+
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress)
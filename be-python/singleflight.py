@@ -0,0 +1,85 @@
+"""In-flight request coalescing ("single flight").
+
+While a call for a key is running, further calls with the same key
+don't start their own; they wait for it and get the same result (or the
+same exception). Coalescing is per process; across workers duplicates
+are caught by the Idempotency-Key table instead.
+"""
+import asyncio
+import threading
+
+from metrics import REGISTRY, Counter
+
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    'coalesced_requests_total', 'Requests by single-flight role', ('endpoint', 'role')))
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread version, for the Flask routes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return (result, shared); ``shared`` is True if another caller did the work"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """Coroutine version, for the ASGI handlers (one event loop per process)"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """Like SingleFlight.do, with ``fn`` a coroutine function"""
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even if nobody was waiting
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
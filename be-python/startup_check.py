@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Startup-time budget check.
+
+Imports ``app`` and calls ``create_app()`` in a fresh interpreter under
+``python -X importtime`` and prints the slowest imports (like
+``python -X importtime`` but summarised). Fails if startup exceeds the
+budget or if heavy modules such as torch/whisper get imported at startup.
+
+    python startup_check.py --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+create_app()
+t2 = time.perf_counter()
+forbidden = [m for m in sys.argv[1].split(',') if m and m in sys.modules]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000, "forbidden_loaded": forbidden}))
+"""
+
+
+def parse_importtime(stderr):
+    """Return [(module, self_us, cumulative_us, depth)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', 1500)))
+    parser.add_argument('--forbid', default='torch,whisper', help="modules that must not be imported at startup")
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    env = dict(os.environ, RESET_DB_ON_START='false', WHISPER_PRELOAD='false', AUDIO_GC_INTERVAL='0', USE_NGROK='false')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, args.forbid],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-4000:])
+        print("create_app() failed")
+        return False
+
+    summary = json.loads(result.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+    total_import_us = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+
+    print(f"Top {args.top} imports by cumulative time (top-level only):")
+    for name, _, cumulative, _ in sorted((r for r in rows if r[3] == 0), key=lambda r: -r[2])[:args.top]:
+        print(f"  {cumulative / 1000:9.1f} ms  {name}")
+    print(f"\nTop {args.top} modules by self time:")
+    for name, self_us, _, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+        print(f"  {self_us / 1000:9.1f} ms  {name}")
+
+    total_ms = summary['import_ms'] + summary['create_app_ms']
+    print(f"\nimports (importtime): {total_import_us / 1000:.1f} ms")
+    print(f"import app:           {summary['import_ms']:.1f} ms")
+    print(f"create_app():         {summary['create_app_ms']:.1f} ms")
+    print(f"total:                {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    ok = True
+    if summary['forbidden_loaded']:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(summary['forbidden_loaded'])}")
+        ok = False
+    if total_ms > args.budget_ms:
+        print("FAIL: startup over budget")
+        ok = False
+    if ok:
+        print("OK")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
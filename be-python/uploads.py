@@ -0,0 +1,328 @@
+"""Size-bounded streaming audio uploads.
+
+Multipart file parts are written straight into a temp file in the audio
+store while Werkzeug parses the body (see UploadRequest), hashing them and
+checking UPLOAD_MAX_BYTES and the duration limit as the bytes arrive.
+A WAV header is read from the first bytes, so a recording that is too
+long is rejected before the rest of it is read. Other formats are
+bounded by size here and by ffprobe once complete.
+
+Clients on unreliable connections can upload in pieces instead:
+
+    POST   /api/uploads              {"length": <bytes>}  -> {"upload_id", "offset": 0}
+    PATCH  /api/uploads/<id>         Upload-Offset: <n>, raw bytes  -> {"offset"}
+    GET    /api/uploads/<id>         -> {"offset", "length", "complete"} (resume point)
+    DELETE /api/uploads/<id>
+
+then pass ``upload_id`` to /api/transcribe or /api/transcribe/long
+instead of the ``audio`` file. Bytes received before a connection drops
+are kept, so the client resumes from the offset reported by GET.
+"""
+import fcntl
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import time
+import uuid
+
+from flask import Blueprint, Request, current_app, jsonify, request
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+from audio_storage import hash_file, now_ms
+
+CHUNK_SIZE = 64 * 1024
+WAV_PROBE_BYTES = 4096  # the fmt and data chunks have to show up within this
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+uploads = Blueprint('uploads', __name__)
+
+
+class WavProbe:
+    """Durasi WAV dari header-nya, diperbarui selagi data masuk"""
+
+    def __init__(self):
+        self.head = b''
+        self.byte_rate = None  # None until parsed, 0 if this isn't a WAV we understand
+        self.data_start = 0
+        self.data_size = None
+
+    def feed(self, chunk):
+        if self.byte_rate is not None:
+            return
+        self.head += bytes(chunk[:WAV_PROBE_BYTES - len(self.head)])
+        self._parse()
+        if self.byte_rate is None and len(self.head) >= WAV_PROBE_BYTES:
+            self.byte_rate = 0
+
+    def _parse(self):
+        head = self.head
+        if len(head) < 12:
+            return
+        if head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+            self.byte_rate = 0
+            return
+        pos, byte_rate = 12, None
+        while pos + 8 <= len(head):
+            chunk_id = head[pos:pos + 4]
+            size = struct.unpack('<I', head[pos + 4:pos + 8])[0]
+            if chunk_id == b'fmt ' and pos + 20 <= len(head):
+                byte_rate = struct.unpack('<I', head[pos + 16:pos + 20])[0]
+            elif chunk_id == b'data':
+                if byte_rate:
+                    self.byte_rate = byte_rate
+                    self.data_start = pos + 8
+                    # Streaming recorders leave the size at 0 or 0xFFFFFFFF until they finish
+                    self.data_size = size if 0 < size < 0xFFFFFFFF else None
+                else:
+                    self.byte_rate = 0
+                return
+            pos += 8 + size + (size & 1)
+
+    def duration(self, received):
+        """Seconds of audio declared by the header or already received, whichever is more"""
+        if not self.byte_rate:
+            return None
+        return max(self.data_size or 0, received - self.data_start) / self.byte_rate
+
+
+class UploadSink(io.FileIO):
+    """File yang menghitung sha256, ukuran dan durasi selagi ditulis; melempar 413 saat melewati batas"""
+
+    def __init__(self, path, max_bytes, max_seconds, mode='w+', hashed=True):
+        super().__init__(path, mode)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.size = os.path.getsize(path)
+        self.probe = WavProbe()
+        if self.size:
+            # Resuming: re-read the header that's already on disk
+            with open(path, 'rb') as f:
+                self.probe.feed(f.read(WAV_PROBE_BYTES))
+        self.digest = hashlib.sha256() if hashed and not self.size else None
+
+    def write(self, b):
+        self.size += len(b)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Audio file too large (max {self.max_bytes / (1024 * 1024):.0f} MB)")
+        self.probe.feed(b)
+        duration = self.probe.duration(self.size)
+        if self.max_seconds and duration and duration > self.max_seconds:
+            raise RequestEntityTooLarge(f"Audio too long (max {self.max_seconds:.0f} seconds)")
+        if self.digest is not None:
+            self.digest.update(b)
+        return super().write(b)
+
+    def hexdigest(self):
+        return self.digest.hexdigest() if self.digest is not None else hash_file(self.path)
+
+
+def duration_limit(endpoint=None):
+    config = current_app.config
+    if endpoint == 'api.transcribe_long':
+        return config['LONGFORM_MAX_DURATION']
+    if endpoint == 'api.transcribe_audio':
+        return config['UPLOAD_MAX_SECONDS']
+    return max(config['UPLOAD_MAX_SECONDS'], config['LONGFORM_MAX_DURATION'])
+
+
+class UploadRequest(Request):
+    """Request whose file parts are streamed into UploadSinks in the audio store's tmp dir.
+
+    Sinks still on disk when the request closes (rejected or never used)
+    are removed; a view that keeps the file moves it away first.
+    """
+
+    _upload_sinks = ()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        store = current_app.extensions['audio_store']
+        sink = UploadSink(store.temp_path(), current_app.config['UPLOAD_MAX_BYTES'], duration_limit(self.endpoint))
+        self._upload_sinks = [*self._upload_sinks, sink]
+        return sink
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for sink in self._upload_sinks:
+                sink.close()
+                if os.path.exists(sink.path):
+                    os.remove(sink.path)
+
+
+def take_audio():
+    """Audio of this request: the streamed ``audio`` part, or a finished ``upload_id``.
+
+    Returns ((path, sha256), None) or (None, (body, status)). The caller
+    owns the file at ``path`` and removes or stores it.
+    """
+    upload_id = request.values.get('upload_id')
+    if upload_id:
+        return resumable_finish(upload_id)
+
+    if 'audio' not in request.files:
+        return None, ({"error": "No audio file provided"}, 400)
+    audio_file = request.files['audio']
+    if audio_file.filename == '':
+        return None, ({"error": "Empty filename"}, 400)
+    sink = audio_file.stream
+    sink.flush()
+    return (sink.path, sink.hexdigest()), None
+
+
+def too_large(e):
+    return jsonify({"error": e.description}), 413
+
+
+# Resumable uploads: <root>/partial/<id>.part plus <id>.json with the declared length
+
+def _paths(upload_id):
+    folder = current_app.extensions['audio_store'].partial_dir
+    return os.path.join(folder, f"{upload_id}.part"), os.path.join(folder, f"{upload_id}.json")
+
+
+def _load(upload_id):
+    """(part path, meta) for a live upload, or (None, None)"""
+    if not UPLOAD_ID_RE.match(upload_id):
+        return None, None
+    part, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['offset'] = os.path.getsize(part)
+    except (OSError, ValueError):
+        return None, None
+    return part, meta
+
+
+def _discard(upload_id):
+    for path in _paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _expire():
+    """Hapus upload yang tidak disentuh lebih lama dari UPLOAD_RESUME_TTL"""
+    folder = current_app.extensions['audio_store'].partial_dir
+    cutoff = time.time() - current_app.config['UPLOAD_RESUME_TTL']
+    for entry in os.scandir(folder):
+        name, ext = os.path.splitext(entry.name)
+        try:
+            if ext == '.json' and UPLOAD_ID_RE.match(name) and \
+                    max(entry.stat().st_mtime, os.path.getmtime(_paths(name)[0])) < cutoff:
+                _discard(name)
+        except FileNotFoundError:
+            _discard(name)
+
+
+def _status(upload_id, meta, code=200):
+    complete = meta['offset'] == meta['length']
+    response = jsonify({"upload_id": upload_id, "offset": meta['offset'], "length": meta['length'],
+                        "complete": complete})
+    response.status_code = code
+    response.headers['Upload-Offset'] = str(meta['offset'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def resumable_finish(upload_id):
+    """Hand a complete upload over to the caller as a temp file; same return as take_audio"""
+    part, meta = _load(upload_id)
+    if part is None:
+        return None, ({"error": "Upload not found"}, 404)
+    if meta['offset'] != meta['length']:
+        return None, ({"error": "Upload incomplete", "offset": meta['offset'], "length": meta['length']}, 409)
+    filepath = current_app.extensions['audio_store'].temp_path()
+    try:
+        os.replace(part, filepath)
+    except FileNotFoundError:
+        return None, ({"error": "Upload not found"}, 404)  # taken by a concurrent request
+    _discard(upload_id)
+    return (filepath, hash_file(filepath)), None
+
+
+@uploads.route('/api/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    length = data.get('length')
+    if not isinstance(length, int) or length <= 0:
+        return jsonify({"error": "length (bytes) is required"}), 400
+    max_bytes = current_app.config['UPLOAD_MAX_BYTES']
+    if length > max_bytes:
+        return jsonify({"error": f"Audio file too large (max {max_bytes / (1024 * 1024):.0f} MB)"}), 413
+
+    _expire()
+    upload_id = uuid.uuid4().hex
+    part, meta_path = _paths(upload_id)
+    meta = {"length": length, "created_at": now_ms()}
+    open(part, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    response = _status(upload_id, {**meta, "offset": 0}, 201)
+    response.headers['Location'] = f"/api/uploads/{upload_id}"
+    return response
+
+
+@uploads.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    part, meta = _load(upload_id)
+    if part is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return _status(upload_id, meta)
+
+
+@uploads.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """Tambahkan potongan mulai dari Upload-Offset; byte yang sudah diterima tetap disimpan walau koneksi putus"""
+    part, meta = _load(upload_id)
+    if part is None:
+        return jsonify({"error": "Upload not found"}), 404
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Upload-Offset header is required"}), 400
+
+    sink = UploadSink(part, meta['length'], duration_limit(), mode='a', hashed=False)
+    try:
+        try:
+            fcntl.flock(sink, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return jsonify({"error": "Another chunk for this upload is in progress"}), 409
+        # Checked under the lock: another chunk may have landed since the file was opened
+        sink.size = os.fstat(sink.fileno()).st_size
+        if offset != sink.size:
+            return jsonify({"error": "Upload-Offset does not match", "offset": sink.size}), 409
+        try:
+            for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b''):
+                sink.write(chunk)
+        except ClientDisconnected:
+            pass  # keep what arrived; the client asks for the offset and resumes
+        except RequestEntityTooLarge:
+            sink.close()
+            _discard(upload_id)
+            raise
+        sink.flush()
+    finally:
+        sink.close()
+    return _status(upload_id, {**meta, "offset": sink.size})
+
+
+@uploads.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    part, _ = _load(upload_id)
+    if part is None:
+        return jsonify({"error": "Upload not found"}), 404
+    _discard(upload_id)
+    return jsonify({"message": "Upload deleted"})
+
+
+def init_app(app):
+    app.request_class = UploadRequest
+    app.register_error_handler(RequestEntityTooLarge, too_large)
+    app.register_blueprint(uploads)
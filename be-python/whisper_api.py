@@ -1,7 +1,6 @@
 import os
 import sys
 import logging
-import torch
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)